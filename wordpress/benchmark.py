@@ -0,0 +1,653 @@
+"""
+Benchmarks against a synthetic WordPress database.
+
+generate() creates the WordPress tables in the WP_DATABASE database, which
+must be SQLite, and fills them with users, terms, posts, attachments, meta
+and comments. run() then measures the query count, wall time and memory of
+the views, template tags, export commands and helpers of this package and
+returns the results as a dict that can be dumped as JSON. load() measures
+the throughput of the views under concurrent requests, with and without
+concurrent lookups.
+"""
+
+import contextlib
+import datetime
+import itertools
+import os
+import platform
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import django
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.db.backends import utils
+from django.template import Context, Template
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from wordpress import concurrency, feeds, serialize, sitemaps, views
+from wordpress.instrumentation import instrument
+from wordpress.models import (Comment, Option, Post, PostMeta, Taxonomy, TermTaxonomyRelationship,
+                              Term, User, UserMeta, TABLE_PREFIX)
+from wordpress.permalinks import permalinks
+from wordpress.router import DATABASE
+
+MODELS = (Option, User, UserMeta, Post, PostMeta, Comment, Term, Taxonomy)
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut '
+         'labore et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris '
+         'nisi aliquip ex ea commodo consequat duis aute irure in reprehenderit voluptate velit esse '
+         'cillum fugiat nulla pariatur excepteur sint occaecat cupidatat non proident sunt culpa qui '
+         'officia deserunt mollit anim id est laborum').split()
+
+
+def connection():
+    return connections[DATABASE]
+
+
+def tables_exist():
+    return Post._meta.db_table in connection().introspection.table_names()
+
+
+def create_tables(force=False):
+    """
+    Create the WordPress tables. Requires Django 1.7 or later.
+
+    If any of them exist, ValueError is raised unless force is True, in
+    which case they are dropped with all their rows.
+    """
+
+    conn = connection()
+    relationships = TermTaxonomyRelationship._meta.db_table
+    existing = conn.introspection.table_names()
+
+    tables = [model._meta.db_table for model in MODELS] + [relationships]
+    found = [table for table in tables if table in existing]
+    if found and not force:
+        raise ValueError("%s already has the tables %s; pass force=True to drop them"
+                         % (conn.settings_dict['NAME'], ', '.join(found)))
+
+    with conn.schema_editor() as editor:
+        for model in MODELS:
+            if model._meta.db_table in existing:
+                editor.delete_model(model)
+            editor.create_model(model)
+
+    # the relationship table has a composite key that Django can't model
+    cursor = conn.cursor()
+    try:
+        cursor.execute('DROP TABLE IF EXISTS %s' % relationships)
+        cursor.execute('CREATE TABLE %s (object_id integer NOT NULL, term_taxonomy_id integer NOT NULL, '
+                       'term_order integer NOT NULL DEFAULT 0, PRIMARY KEY (object_id, term_taxonomy_id))'
+                       % relationships)
+        cursor.execute('CREATE INDEX %s_term_taxonomy_id ON %s (term_taxonomy_id)' % (relationships, relationships))
+        cursor.execute('CREATE INDEX %s_type_status_date ON %s (post_type, post_status, post_date, ID)'
+                       % (Post._meta.db_table, Post._meta.db_table))
+        cursor.execute('CREATE INDEX %s_post_name ON %s (post_name)' % (Post._meta.db_table, Post._meta.db_table))
+    finally:
+        cursor.close()
+
+
+def _words(rng, count):
+    return ' '.join(rng.choice(WORDS) for i in range(count))
+
+
+def widget_payload(rng, widgets=300):
+    """
+    Return a value shaped like a widget_text option: numbered text widget
+    instances with HTML content. About 100KB serialized with the default
+    count.
+    """
+    value = {}
+    for i in range(2, widgets + 2):
+        value[i] = {
+            'title': _words(rng, rng.randint(1, 4)),
+            'text': u'<p>%s</p>\n<p>%s \u2014 %s</p>' % (_words(rng, 30), _words(rng, 10), _words(rng, 5)),
+            'filter': rng.random() < 0.5,
+            'visual': True,
+        }
+    value['_multiwidget'] = 1
+    return value
+
+
+def theme_mods_payload(rng, sections=80):
+    """
+    Return a value shaped like a theme_mods_* option: menu locations, header
+    image data and nested customizer settings. About 100KB serialized with
+    the default count.
+    """
+    value = {
+        'nav_menu_locations': dict(('location-%i' % i, i) for i in range(10)),
+        'custom_css_post_id': -1,
+        'header_image_data': {'attachment_id': 12, 'url': 'http://example.com/header.jpg',
+                              'width': 1200, 'height': 280.5, 'alt_text': None},
+        'sidebars_widgets': {'time': 1500000000, 'data': dict(
+            ('sidebar-%i' % i, ['text-%i' % j for j in range(i * 10, i * 10 + 10)]) for i in range(10))},
+    }
+    for i in range(sections):
+        value['section_%i' % i] = dict(
+            ('setting_%i' % j, rng.choice([_words(rng, 8), rng.randint(0, 1000), rng.random() < 0.5,
+                                           [_words(rng, 2) for k in range(3)]]))
+            for j in range(25))
+    return value
+
+
+def _bulk_create(model, objs):
+    model.objects.using(DATABASE).bulk_create(objs)
+    del objs[:]
+
+
+def generate(posts=1000, meta=5, terms=50, comments=3, users=20, seed=0, chunk_size=1000, force=False):
+    """
+    Create the WordPress tables and fill them with synthetic content.
+
+    Half of the terms are hierarchical categories and half are tags. Each
+    post gets a category, up to four tags, meta values per post, comments
+    per post (some of them replies or spam) and, for every third post, an
+    attachment. One in ten posts is a draft. The same seed generates the
+    same database. Existing tables are only dropped if force is True.
+    """
+
+    rng = random.Random(seed)
+    start = datetime.datetime(2010, 1, 1)
+
+    create_tables(force)
+
+    options = [
+        ('siteurl', 'http://example.com'),
+        ('home', 'http://example.com'),
+        ('blogname', 'Benchmark'),
+        ('permalink_structure', '/%year%/%monthnum%/%day%/%postname%/'),
+        ('sticky_posts', serialize.dumps(list(range(1, min(posts, 5) + 1)))),
+    ]
+    Option.objects.using(DATABASE).bulk_create([
+        Option(id=i + 1, name=name, value=value, autoload='yes') for (i, (name, value)) in enumerate(options)])
+
+    user_objs = []
+    usermeta_objs = []
+    for i in range(1, users + 1):
+        user_objs.append(User(id=i, login='user%i' % i, password='', username='user%i' % i,
+                              email='user%i@example.com' % i, url='', date_registered=start,
+                              activation_key='', display_name='User %i' % i))
+        usermeta_objs.append(UserMeta(id=i * 2 - 1, user_id=i, key='first_name', value='User'))
+        usermeta_objs.append(UserMeta(id=i * 2, user_id=i, key='nickname', value='user%i' % i))
+    _bulk_create(User, user_objs)
+    _bulk_create(UserMeta, usermeta_objs)
+
+    categories = []
+    tags = []
+    objs = []
+    for i in range(1, terms + 1):
+        objs.append(Term(id=i, name='Term %i' % i, slug='term-%i' % i))
+    _bulk_create(Term, objs)
+    for i in range(1, terms + 1):
+        if i % 2:
+            parent = rng.choice(categories) if categories and rng.random() < 0.5 else 0
+            categories.append(i)
+            objs.append(Taxonomy(id=i, term_id=i, name='category', description='', parent_id=parent))
+        else:
+            tags.append(i)
+            objs.append(Taxonomy(id=i, term_id=i, name='post_tag', description=''))
+    _bulk_create(Taxonomy, objs)
+
+    counts = dict((i, 0) for i in range(1, terms + 1))
+    post_objs = []
+    meta_objs = []
+    comment_objs = []
+    relationships = []
+    attachment_id = posts
+    meta_id = 0
+    comment_id = 0
+
+    for i in range(1, posts + 1):
+
+        post_date = start + datetime.timedelta(seconds=i * 3 * 3600 + rng.randint(0, 3600))
+        modified = post_date + datetime.timedelta(days=rng.randint(0, 30))
+        status = 'draft' if rng.random() < 0.1 else 'publish'
+        paragraphs = ['<p>%s.</p>' % _words(rng, rng.randint(40, 150)) for j in range(rng.randint(2, 10))]
+        post_comments = comments if status == 'publish' else 0
+
+        post_objs.append(Post(
+            id=i, guid='http://example.com/?p=%i' % i, post_type='post', status=status,
+            title=_words(rng, rng.randint(3, 8)).capitalize(), slug='post-%i' % i,
+            author_id=rng.randint(1, users), excerpt='' if i % 4 else _words(rng, 30),
+            content='\n\n'.join(paragraphs), content_filtered='', post_date=post_date, post_date_gmt=post_date,
+            modified=modified, modified_gmt=modified, comment_status='open', comment_count=post_comments,
+            ping_status='open', to_ping='', pinged='', password='', mime_type=''))
+
+        if i % 3 == 0:
+            attachment_id += 1
+            post_objs.append(Post(
+                id=attachment_id, guid='http://example.com/files/image-%i.jpg' % i, post_type='attachment',
+                status='inherit', title='Image %i' % i, slug='image-%i' % i, author_id=1, excerpt='',
+                content='', content_filtered='', post_date=post_date, post_date_gmt=post_date,
+                modified=post_date, modified_gmt=post_date, comment_status='open', ping_status='open', to_ping='',
+                pinged='', password='', parent_id=i, mime_type='image/jpeg'))
+
+        post_terms = []
+        if categories:
+            post_terms.append(rng.choice(categories))
+        if tags:
+            post_terms.extend(rng.sample(tags, min(len(tags), rng.randint(0, 4))))
+        for (order, tt_id) in enumerate(post_terms):
+            relationships.append((i, tt_id, order))
+            if status == 'publish':
+                counts[tt_id] += 1
+
+        for j in range(meta):
+            meta_id += 1
+            if j == 0:
+                value = serialize.dumps({'width': 640, 'height': 480, 'file': 'image-%i.jpg' % i})
+            else:
+                value = _words(rng, rng.randint(1, 10))
+            meta_objs.append(PostMeta(id=meta_id, post_id=i, key='meta_%i' % j, value=value))
+
+        first = comment_id + 1
+        for j in range(post_comments):
+            comment_id += 1
+            comment_objs.append(Comment(
+                id=comment_id, post_id=i, parent_id=rng.choice((0, 0, first)) if comment_id > first else 0,
+                author_name='Commenter %i' % comment_id, author_email='c%i@example.com' % comment_id,
+                author_url='', author_ip='127.0.0.1', post_date=post_date + datetime.timedelta(hours=j + 1),
+                post_date_local=post_date + datetime.timedelta(hours=j + 1), content=_words(rng, rng.randint(5, 60)),
+                approved='spam' if rng.random() < 0.05 else '1', agent='', comment_type=''))
+
+        if len(post_objs) >= chunk_size:
+            _bulk_create(Post, post_objs)
+            _bulk_create(PostMeta, meta_objs)
+            _bulk_create(Comment, comment_objs)
+
+    _bulk_create(Post, post_objs)
+    _bulk_create(PostMeta, meta_objs)
+    _bulk_create(Comment, comment_objs)
+
+    cursor = connection().cursor()
+    try:
+        cursor.executemany('INSERT INTO %s (object_id, term_taxonomy_id, term_order) VALUES (%%s, %%s, %%s)'
+                           % TermTaxonomyRelationship._meta.db_table, relationships)
+        cursor.executemany('UPDATE %s SET count = %%s WHERE term_taxonomy_id = %%s' % Taxonomy._meta.db_table,
+                           [(count, tt_id) for (tt_id, count) in counts.items()])
+    finally:
+        cursor.close()
+
+    return table_counts()
+
+
+def table_counts():
+    counts = dict((model._meta.db_table, model.objects.count()) for model in MODELS)
+    counts[TermTaxonomyRelationship._meta.db_table] = TermTaxonomyRelationship.objects.count()
+    return counts
+
+
+def reset_caches():
+    """
+    Clear the Django cache and the in-process caches of the package.
+    """
+    cache.clear()
+    Option.objects.invalidate()
+    Taxonomy.objects._trees.clear()
+    permalinks._refreshed = 0
+
+
+def measure(func, repeat=5):
+    """
+    Run func repeat times after clearing caches and return its query counts,
+    database time and wall time, both cold and warm, and peak memory.
+    """
+
+    reset_caches()
+
+    times = []
+    recordings = []
+    for i in range(repeat):
+        with instrument() as recording:
+            start = time.time()
+            func()
+            times.append(time.time() - start)
+        recordings.append(recording)
+
+    peak_memory = None
+    if tracemalloc is not None:
+        reset_caches()
+        tracemalloc.start()
+        try:
+            func()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    (cold, warm) = (recordings[0], recordings[-1])
+    ordered = sorted(times)
+
+    return {
+        'queries': cold.queries,
+        'queries_warm': warm.queries,
+        'queries_by_label': dict((label, stat.queries) for (label, stat) in cold.stats.items() if stat.queries),
+        'db_time': cold.db_time,
+        'cache_hits_warm': warm.cache_hits,
+        'time_cold': times[0],
+        'time_min': ordered[0],
+        'time_median': ordered[len(ordered) // 2],
+        'peak_memory': peak_memory,
+    }
+
+
+def legacy_term(terms, taxonomy='post_tag'):
+    """
+    PostManager.term() as it was before 0.11: published posts whose ID is
+    in a subquery of the relationships of the matching taxonomies. Kept to
+    compare against the join that replaced it.
+    """
+    terms = terms if isinstance(terms, (list, tuple)) else [terms]
+    tx = Taxonomy.objects.filter(name=taxonomy, term__slug__in=terms)
+    post_ids = TermTaxonomyRelationship.objects.filter(term_taxonomy__in=tx).values_list('object_id', flat=True)
+    return Post.objects.published().filter(pk__in=post_ids)
+
+
+def explain(queryset):
+    """
+    Return the query plan of a queryset as a list of lines.
+    """
+
+    conn = connections[queryset.db]
+    (sql, params) = queryset.query.sql_with_params()
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.vendor == 'sqlite' else 'EXPLAIN '
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(prefix + sql, params)
+        return [' | '.join('%s' % column for column in row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def compare_term(repeat=5):
+    """
+    Return the query plan and timings of PostManager.term() and of
+    legacy_term() for the most used tag, fetching the first page of posts.
+    """
+
+    tag = Taxonomy.objects.filter(name='post_tag', count__gt=0).select_related('term').order_by('-count')[0]
+    querysets = [
+        ('join', Post.objects.term(tag.term.slug)),
+        ('legacy', legacy_term(tag.term.slug)),
+    ]
+
+    results = {'term': tag.term.slug, 'posts': tag.count}
+    for (name, qs) in querysets:
+        page = qs.order_by('-post_date')[:10]
+        result = measure(lambda: list(page.values_list('pk', flat=True)), repeat)
+        result['plan'] = explain(page)
+        results[name] = result
+
+    return results
+
+
+def _view(view, path, **kwargs):
+    factory = RequestFactory()
+
+    def run():
+        response = view(factory.get(path), **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    return run
+
+
+def benchmarks():
+    """
+    Return a list of (name, function) pairs to measure.
+    """
+
+    posts = Post.objects.published().order_by('pk')
+    count = posts.count()
+    post = posts[count // 2]
+    attachment = Post.objects.filter(post_type='attachment', parent_id__in=posts.values('pk')).order_by('pk')[0]
+    parent = Post.objects.get(pk=attachment.parent_id)
+    category = Taxonomy.objects.filter(name='category', count__gt=0).select_related('term').order_by('-count')[0]
+    tag = Taxonomy.objects.filter(name='post_tag', count__gt=0).select_related('term').order_by('-count')[0]
+    other_tag = Taxonomy.objects.filter(name='post_tag', count__gt=0).select_related('term').order_by('-count')[1]
+    date = post.post_date
+
+    def date_kwargs(post):
+        return {'year': str(post.post_date.year), 'month': '%02i' % post.post_date.month,
+                'day': '%02i' % post.post_date.day, 'slug': post.slug}
+
+    recentposts = Template('{% load wp %}{% recentposts 10 %}{{ post.title }} {{ post.tags|length }}'
+                           '{% endrecentposts %}')
+    serialized = Option.objects.get_value('sticky_posts')
+    meta = serialize.loads(PostMeta.objects.filter(key='meta_0').values_list('value', flat=True)[0])
+
+    def term_or():
+        list(Post.objects.term([tag.term.slug, other_tag.term.slug])[:10])
+
+    def term_and():
+        list(Post.objects.term({'post_tag': tag.term.slug, 'category': category.term.slug}, operator='and')[:10])
+
+    def term_legacy():
+        list(legacy_term([tag.term.slug, other_tag.term.slug])[:10])
+
+    def term_children():
+        list(Post.objects.term(category.term.slug, taxonomy='category', include_children=True)[:10])
+
+    def export(command, **options):
+        return lambda: call_command(command, output=os.devnull, verbosity=0, **options)
+
+    def search():
+        list(Post.objects.search('lorem dolor')[:10])
+
+    def generate_sitemaps():
+        # written to a temporary directory, so no sitemap storage has to be set up
+        (original, sitemaps.SITEMAP_ROOT) = (sitemaps.SITEMAP_ROOT, tempfile.mkdtemp())
+        try:
+            sitemaps.generate('http://example.com')
+        finally:
+            shutil.rmtree(sitemaps.SITEMAP_ROOT)
+            sitemaps.SITEMAP_ROOT = original
+
+    def serialize_loads():
+        for i in range(1000):
+            serialize.loads(serialized)
+
+    def serialize_dumps():
+        for i in range(1000):
+            serialize.dumps(meta)
+
+    rng = random.Random(0)
+    large = [widget_payload(rng), theme_mods_payload(rng)]
+    large_serialized = [serialize.dumps(value) for value in large]
+
+    def serialize_loads_large():
+        for data in large_serialized:
+            serialize.loads(data)
+
+    def serialize_dumps_large():
+        for value in large:
+            serialize.dumps(value)
+
+    return [
+        ('views.Archive', _view(views.Archive.as_view(), '/')),
+        ('views.YearArchive', _view(views.YearArchive.as_view(), '/', year=str(date.year))),
+        ('views.MonthArchive', _view(views.MonthArchive.as_view(), '/', year=str(date.year),
+                                     month='%02i' % date.month)),
+        ('views.DayArchive', _view(views.DayArchive.as_view(), '/', year=str(date.year),
+                                   month='%02i' % date.month, day='%02i' % date.day)),
+        ('views.AuthorArchive', _view(views.AuthorArchive.as_view(), '/', username=post.author.login)),
+        ('views.TaxonomyArchive', _view(views.TaxonomyArchive.as_view(), '/', taxonomy='category',
+                                        term=category.term.slug)),
+        ('views.PostDetail', _view(views.PostDetail.as_view(), '/', **date_kwargs(post))),
+        ('views.PostAttachment', _view(views.PostAttachment.as_view(), '/', attachment_slug=attachment.slug,
+                                       **date_kwargs(parent))),
+        ('views.Preview', _view(views.Preview.as_view(), '/', p=post.pk)),
+        ('feeds.PostFeed', _view(feeds.PostFeed(), '/')),
+        ('feeds.TaxonomyFeed', _view(feeds.TaxonomyFeed(), '/', taxonomy='category', term=category.term.slug)),
+        ('feeds.CommentFeed', _view(feeds.CommentFeed(), '/', **date_kwargs(post))),
+        ('recentposts', lambda: recentposts.render(Context())),
+        ('PostManager.term.or', term_or),
+        ('PostManager.term.and', term_and),
+        ('PostManager.term.include_children', term_children),
+        ('PostManager.term.legacy', term_legacy),
+        ('PostManager.search', search),
+        ('serialize.loads.x1000', serialize_loads),
+        ('serialize.dumps.x1000', serialize_dumps),
+        ('serialize.loads.large', serialize_loads_large),
+        ('serialize.dumps.large', serialize_dumps_large),
+        ('wpexport', export('wpexport')),
+        ('wpexport.jsonl', export('wpexport', format='jsonl')),
+        ('wpexportauthors', export('wpexportauthors', meta=['nickname'])),
+        ('sitemaps.generate', generate_sitemaps),
+    ]
+
+
+# requests from RequestFactory are for the host testserver
+@override_settings(ALLOWED_HOSTS=['testserver'])
+def run(repeat=5, names=None):
+    """
+    Measure each benchmark, or those whose names start with one of names,
+    and return the results with details of the environment.
+    """
+
+    results = {}
+
+    for (name, func) in benchmarks():
+        if names and not any(name.startswith(prefix) for prefix in names):
+            continue
+        try:
+            results[name] = measure(func, repeat)
+        except Exception as e:
+            results[name] = {'error': '%s: %s' % (e.__class__.__name__, e)}
+
+    extra = {}
+    if not names or any('PostManager.term'.startswith(prefix) or prefix.startswith('PostManager.term')
+                        for prefix in names):
+        extra['term_comparison'] = compare_term(repeat)
+
+    return dict(extra, **{
+        'created': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection().vendor,
+        'table_prefix': TABLE_PREFIX,
+        'tables': table_counts(),
+        'repeat': repeat,
+        'benchmarks': results,
+    })
+
+
+@contextlib.contextmanager
+def simulated_latency(seconds):
+    """
+    Add a delay to every query, as if the database were on another host.
+    """
+
+    execute = utils.CursorWrapper.execute
+    executemany = utils.CursorWrapper.executemany
+
+    def slow_execute(self, *args, **kwargs):
+        time.sleep(seconds)
+        return execute(self, *args, **kwargs)
+
+    def slow_executemany(self, *args, **kwargs):
+        time.sleep(seconds)
+        return executemany(self, *args, **kwargs)
+
+    utils.CursorWrapper.execute = slow_execute
+    utils.CursorWrapper.executemany = slow_executemany
+    try:
+        yield
+    finally:
+        utils.CursorWrapper.execute = execute
+        utils.CursorWrapper.executemany = executemany
+
+
+def _serve(funcs, requests, workers):
+    """
+    Call the functions round-robin from a number of worker threads and
+    return the throughput and latency.
+    """
+
+    tasks = itertools.islice(itertools.cycle(funcs), requests)
+    lock = threading.Lock()
+    latencies = []
+    errors = []
+
+    def worker():
+        while True:
+            with lock:
+                func = next(tasks, None)
+            if func is None:
+                break
+            start = time.time()
+            try:
+                func()
+            except Exception as e:
+                errors.append('%s: %s' % (e.__class__.__name__, e))
+            latencies.append(time.time() - start)
+        for connection in connections.all():
+            connection.close()
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_second': len(latencies) / seconds if seconds else None,
+        'latency_mean': sum(latencies) / len(latencies) if latencies else None,
+        'latency_p95': latencies[int(len(latencies) * 0.95)] if latencies else None,
+    }
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+def load(requests=200, workers=8, latency=0.005, lookup_threads=4, names=None):
+    """
+    Serve requests to the views from a fixed number of worker threads, first
+    with lookups run one after the other and then concurrently on a pool of
+    lookup_threads threads, with latency seconds added to each query.
+
+    The database must be an SQLite file, as each thread has its own
+    connection.
+    """
+
+    if connection().settings_dict['NAME'] in ('', ':memory:'):
+        raise ValueError("load benchmarks need an SQLite database file, not an in-memory database")
+
+    funcs = [func for (name, func) in benchmarks() if name.startswith('views.') and
+             (not names or any(name.startswith(prefix) for prefix in names))]
+    for func in funcs:
+        func()
+
+    results = {
+        'requests': requests,
+        'workers': workers,
+        'latency': latency,
+        'lookup_threads': lookup_threads,
+    }
+
+    original = concurrency.CONCURRENT_LOOKUPS
+    try:
+        with simulated_latency(latency):
+            for (mode, threads) in (('sequential', 0), ('concurrent', lookup_threads)):
+                concurrency.CONCURRENT_LOOKUPS = threads
+                reset_caches()
+                results[mode] = _serve(funcs, requests, workers)
+    finally:
+        concurrency.CONCURRENT_LOOKUPS = original
+
+    return results
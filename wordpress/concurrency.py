@@ -0,0 +1,64 @@
+"""
+Running independent database lookups concurrently.
+
+The ORM is synchronous, so lookups that don't depend on each other, such as
+the terms, meta and attachments of a page of posts, are otherwise run one
+after the other and a request waits for each round trip in turn. If
+WP_CONCURRENT_LOOKUPS is set to a number of threads, run_concurrently()
+runs them on a shared pool of that many threads instead. This only pays
+off when the database is on another host; set CONN_MAX_AGE so the pool
+threads keep their connections between requests.
+"""
+
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connections
+from wordpress import router
+
+CONCURRENT_LOOKUPS = getattr(settings, "WP_CONCURRENT_LOOKUPS", 0)
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPool(CONCURRENT_LOOKUPS)
+    return _pool
+
+
+def _call(args):
+
+    (func, state) = args
+
+    _local.in_pool = True
+    router.set_state(state)
+
+    try:
+        return func()
+    finally:
+        for connection in connections.all():
+            connection.close_if_unusable_or_obsolete()
+
+
+def run_concurrently(*funcs):
+    """
+    Call each function and return a list of their results.
+
+    The functions are called on the thread pool if WP_CONCURRENT_LOOKUPS is
+    set, with the read replica pinning of the calling thread, and one after
+    the other otherwise or when called from a pool thread. Queries run on
+    the pool aren't seen by wordpress.instrumentation.
+    """
+
+    if CONCURRENT_LOOKUPS < 2 or len(funcs) < 2 or getattr(_local, 'in_pool', False):
+        return [func() for func in funcs]
+
+    state = router.get_state()
+    return get_pool().map(_call, [(func, state) for func in funcs])
@@ -0,0 +1,440 @@
+"""
+Exporting posts in chunks, optionally sharded across worker processes, and
+feeds of the posts and comments changed since a previous export.
+"""
+
+import codecs
+import collections
+import datetime
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Max, Q
+from wordpress.models import Comment, Post, User, UserMeta, prefetch_meta, prefetch_terms
+from wordpress.wxr import WXRWriter
+
+
+def prefetch_comments(posts):
+    """
+    Load the non-spam comments of each post with a single query.
+
+    Returns a dict of post IDs to lists of comments.
+    """
+    comments = collections.defaultdict(list)
+    qs = Comment.objects.filter(post__in=[post.pk for post in posts]).exclude(approved='spam')
+    for comment in qs.order_by('id'):
+        comments[comment.post_id].append(comment)
+    return comments
+
+
+def export_queryset(post_type='post', since=None):
+    """
+    Return the queryset of posts that are exported for a post type.
+    """
+    status = 'inherit' if post_type == 'attachment' else 'publish'
+    qs = Post.objects.filter(post_type=post_type, status=status)
+    if since is not None:
+        qs = qs.filter(post_date__gte=since)
+    return qs
+
+
+def iter_chunks(qs, chunk_size=500):
+    """
+    Yield lists of posts from a queryset in primary key order.
+
+    Each chunk is fetched with a keyset query on the primary key so memory
+    use does not grow with the size of the queryset. Authors, terms and meta
+    are loaded in a fixed number of queries per chunk.
+    """
+
+    qs = qs.select_related('author').order_by('pk')
+    last_pk = None
+
+    while True:
+
+        chunk_qs = qs if last_pk is None else qs.filter(pk__gt=last_pk)
+        chunk = list(chunk_qs[:chunk_size])
+
+        if not chunk:
+            break
+
+        prefetch_terms(chunk)
+        prefetch_meta(chunk)
+
+        yield chunk
+
+        last_pk = chunk[-1].pk
+
+
+def iter_authors(chunk_size=1000, meta_keys=()):
+    """
+    Yield (id, login, display_name, email, meta) tuples for all users in
+    primary key order.
+
+    Users are read in keyset chunks as tuples rather than model instances.
+    If meta_keys are given, the first value of each of those keys is loaded
+    with one query per chunk and included in the meta dict.
+    """
+
+    qs = User.objects.order_by('pk').values_list('id', 'login', 'display_name', 'email')
+    last_pk = None
+
+    while True:
+
+        chunk_qs = qs if last_pk is None else qs.filter(pk__gt=last_pk)
+        chunk = list(chunk_qs[:chunk_size])
+
+        if not chunk:
+            break
+
+        meta = collections.defaultdict(dict)
+        if meta_keys:
+            meta_qs = UserMeta.objects.filter(user__in=[row[0] for row in chunk], key__in=meta_keys)
+            for (user_id, key, value) in meta_qs.order_by('-id').values_list('user_id', 'key', 'value'):
+                meta[user_id][key] = value
+
+        for row in chunk:
+            yield row + (meta.get(row[0], {}),)
+
+        last_pk = chunk[-1][0]
+
+
+#
+# change feed
+#
+
+CHANGE_POST_TYPES = ('post', 'page', 'attachment')
+
+WATERMARK_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def is_live(post):
+    """
+    Return True if a post is visible on the site, False if consumers of the
+    change feed should delete it.
+    """
+    return post.status == ('inherit' if post.post_type == 'attachment' else 'publish')
+
+
+def tombstone(post):
+    return {
+        'type': 'deleted',
+        'id': post.pk,
+        'post_type': post.post_type,
+        'status': post.status,
+        'modified': post.modified,
+    }
+
+
+def iter_changes(watermark=None, post_types=CHANGE_POST_TYPES, chunk_size=500):
+    """
+    Yield (records, watermark) pairs for the posts and comments changed since
+    a watermark returned by an earlier call, or for everything if it is None.
+
+    Posts are read in keyset chunks ordered by (post_modified, ID), so only
+    changed rows are read. Live posts are returned as post records with
+    their terms, meta and comments, the others as deleted records. New
+    comments on posts that haven't changed follow as comment records.
+
+    The watermark yielded with each chunk is a dict that can be stored as
+    JSON and passed back in to resume after that chunk. Records may be
+    repeated after an interruption, so consumers should upsert them by ID.
+    Posts deleted without being trashed first are not detected.
+
+    Comments are tracked by ID only, as WordPress doesn't record when they
+    change: new comments are returned, but comments that are approved,
+    unapproved, edited or deleted are only picked up with their post the
+    next time the post itself is modified.
+    """
+
+    watermark = dict(watermark or {})
+
+    # a full export includes all comments with their posts, so comments up
+    # to the latest one are skipped when resuming it or reading changes
+    full = 'comment_id' not in watermark
+    if full:
+        watermark['comment_id'] = Comment.objects.aggregate(last=Max('pk'))['last'] or 0
+
+    qs = Post.objects.filter(post_type__in=post_types).select_related('author').order_by('modified', 'pk')
+
+    if watermark.get('modified'):
+        modified = datetime.datetime.strptime(watermark['modified'], WATERMARK_FORMAT)
+        chunk_qs = qs.filter(Q(modified__gt=modified) | Q(modified=modified, pk__gt=watermark['id']))
+    else:
+        chunk_qs = qs
+
+    while True:
+
+        chunk = list(chunk_qs[:chunk_size])
+        if not chunk:
+            break
+
+        live = [post for post in chunk if is_live(post)]
+        prefetch_terms(live)
+        prefetch_meta(live)
+        comments = prefetch_comments(live)
+
+        records = [post_to_dict(post, comments.get(post.pk, ())) if is_live(post) else tombstone(post)
+                   for post in chunk]
+
+        last = chunk[-1]
+        watermark.update({'modified': last.modified.strftime(WATERMARK_FORMAT), 'id': last.pk})
+        yield (records, dict(watermark))
+
+        chunk_qs = qs.filter(Q(modified__gt=last.modified) | Q(modified=last.modified, pk__gt=last.pk))
+
+    if full:
+        yield ([], dict(watermark))
+        return
+
+    qs = Comment.objects.exclude(approved='spam').order_by('pk')
+
+    while True:
+
+        chunk = list(qs.filter(pk__gt=watermark['comment_id'])[:chunk_size])
+        if not chunk:
+            break
+
+        records = []
+        for comment in chunk:
+            record = comment_to_dict(comment)
+            record.update({'type': 'comment', 'post': comment.post_id})
+            records.append(record)
+
+        watermark['comment_id'] = chunk[-1].pk
+        yield (records, dict(watermark))
+
+
+#
+# JSON lines
+#
+
+def post_to_dict(post, comments=()):
+    return {
+        'type': 'post',
+        'id': post.pk,
+        'guid': post.guid,
+        'post_type': post.post_type,
+        'status': post.status,
+        'title': post.title,
+        'slug': post.slug,
+        'author': post.author_id,
+        'excerpt': post.excerpt,
+        'content': post.content,
+        'post_date': post.post_date,
+        'modified': post.modified,
+        'comment_status': post.comment_status,
+        'comment_count': post.comment_count,
+        'ping_status': post.ping_status,
+        'password': post.password,
+        'parent': post.parent_id,
+        'menu_order': post.menu_order,
+        'mime_type': post.mime_type,
+        'terms': dict((taxonomy, [term.slug for term in terms])
+                      for (taxonomy, terms) in (post.term_cache or {}).items()),
+        'meta': dict((key, post.meta_dict.getlist(key)) for key in post.meta_dict),
+        'comments': [comment_to_dict(comment) for comment in comments],
+    }
+
+
+def comment_to_dict(comment):
+    return {
+        'id': comment.pk,
+        'parent': comment.parent_id,
+        'user': comment.user_id,
+        'author_name': comment.author_name,
+        'author_email': comment.author_email,
+        'author_url': comment.author_url,
+        'author_ip': comment.author_ip,
+        'post_date': comment.post_date,
+        'content': comment.content,
+        'approved': comment.approved,
+        'comment_type': comment.comment_type,
+    }
+
+
+class JSONLWriter(object):
+    """
+    Writes authors and posts to a stream as one JSON object per line.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write_object(self, obj):
+        self.stream.write(json.dumps(obj, cls=DjangoJSONEncoder))
+        self.stream.write(u'\n')
+
+    def write_header(self, generator=None):
+        pass
+
+    def write_footer(self):
+        pass
+
+    def write_authors(self, author_ids, chunk_size=500):
+        author_ids = sorted(author_ids)
+        for i in range(0, len(author_ids), chunk_size):
+            qs = User.objects.filter(pk__in=author_ids[i:i + chunk_size]).order_by('pk')
+            for (author_id, login, email, display_name) in qs.values_list('id', 'login', 'email', 'display_name'):
+                self.write_object({
+                    'type': 'author',
+                    'id': author_id,
+                    'login': login,
+                    'email': email,
+                    'display_name': display_name,
+                })
+
+    def write_post(self, post, comments=()):
+        self.write_object(post_to_dict(post, comments))
+
+
+WRITERS = {
+    'jsonl': JSONLWriter,
+    'wxr': WXRWriter,
+}
+
+
+#
+# export
+#
+
+def export(stream, qs, format='wxr', chunk_size=500, generator=None, header=True, footer=True):
+    """
+    Write the posts in a queryset to stream.
+
+    Set header or footer to False to write only the items, as is done for
+    shards that are stitched together later. Returns the number of posts
+    written.
+    """
+
+    writer = WRITERS[format](stream)
+
+    if header:
+        writer.write_header(generator)
+        writer.write_authors(set(qs.order_by().values_list('author', flat=True).distinct()), chunk_size)
+
+    count = 0
+    for chunk in iter_chunks(qs, chunk_size):
+        comments = prefetch_comments(chunk)
+        for post in chunk:
+            writer.write_post(post, comments.get(post.pk, ()))
+        count += len(chunk)
+
+    if footer:
+        writer.write_footer()
+
+    return count
+
+
+def shard_ranges(qs, shards):
+    """
+    Split a queryset into primary key ranges with roughly equal post counts.
+
+    Returns a list of (first_pk, last_pk) tuples.
+    """
+
+    qs = qs.order_by('pk')
+    total = qs.count()
+    shards = max(1, min(shards, total))
+
+    if total == 0:
+        return []
+
+    bounds = [qs.values_list('pk', flat=True)[total * i // shards] for i in range(shards)]
+    last = qs.reverse().values_list('pk', flat=True)[0]
+
+    return [(bounds[i], bounds[i + 1] - 1 if i + 1 < shards else last) for i in range(shards)]
+
+
+def export_shard(args):
+    """
+    Export one primary key range to a file. Run in a worker process.
+
+    Returns a tuple of shard index, number of posts and seconds taken.
+    """
+
+    (index, (first_pk, last_pk), path, options) = args
+
+    # never share a database connection with the parent process
+    for conn in connections.all():
+        conn.close()
+
+    qs = export_queryset(options['post_type'], options['since']).filter(pk__gte=first_pk, pk__lte=last_pk)
+
+    start = time.time()
+    stream = codecs.open(path, 'w', 'utf-8')
+    try:
+        count = export(stream, qs, options['format'], options['chunk_size'], options['generator'],
+                       header=options['split'], footer=options['split'])
+    finally:
+        stream.close()
+
+    return (index, count, time.time() - start)
+
+
+def export_sharded(path, workers, post_type='post', since=None, format='wxr', chunk_size=500,
+                   generator=None, split=False, report=None):
+    """
+    Export posts to path using a pool of worker processes.
+
+    Posts are partitioned into primary key ranges, one per worker. Each
+    shard is written to a numbered file, path.1 through path.N. Unless split
+    is True, the shards are then stitched into a single document at path and
+    the numbered files are removed.
+
+    If given, report is called with the shard index, number of posts and
+    seconds taken as each shard finishes. Returns the total number of posts.
+    """
+
+    qs = export_queryset(post_type, since)
+    ranges = shard_ranges(qs, workers)
+    paths = ['%s.%i' % (path, i + 1) for i in range(len(ranges))]
+
+    options = {
+        'post_type': post_type,
+        'since': since,
+        'format': format,
+        'chunk_size': chunk_size,
+        'generator': generator,
+        'split': split,
+    }
+
+    tasks = [(i, ranges[i], paths[i], options) for i in range(len(ranges))]
+
+    for conn in connections.all():
+        conn.close()
+
+    total = 0
+    pool = multiprocessing.Pool(max(1, len(tasks)))
+    try:
+        for (index, count, seconds) in pool.imap_unordered(export_shard, tasks):
+            total += count
+            if report is not None:
+                report(index + 1, count, seconds)
+    finally:
+        pool.close()
+        pool.join()
+
+    if not split:
+
+        stream = codecs.open(path, 'w', 'utf-8')
+        try:
+            writer = WRITERS[format](stream)
+            writer.write_header(generator)
+            writer.write_authors(set(qs.order_by().values_list('author', flat=True).distinct()), chunk_size)
+            for shard_path in paths:
+                with codecs.open(shard_path, 'r', 'utf-8') as shard:
+                    shutil.copyfileobj(shard, stream)
+            writer.write_footer()
+        finally:
+            stream.close()
+
+        for shard_path in paths:
+            os.remove(shard_path)
+
+    return total
@@ -0,0 +1,244 @@
+"""
+RSS 2.0 and Atom feeds of posts and comments.
+
+Feeds answer conditional GETs with 304 responses and, if cache_timeout is
+set, cache their rendered output. Both are keyed on a version stamp of the
+items in the feed: the ID, modification date and comment count of the
+latest posts, or the IDs of the latest approved comments. The stamp is read
+with one small query, so an unchanged feed is served without loading its
+posts.
+"""
+
+import calendar
+import copy
+import hashlib
+
+from django.conf import settings
+from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse, HttpResponseNotModified, Http404
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.http import http_date, quote_etag
+from wordpress.instrumentation import instrumented, record_cache
+from wordpress.models import Comment, Option, Post, Term, User
+from wordpress.permalinks import permalinks
+from wordpress.views import TAXONOMIES, not_modified
+
+FEED_ITEMS = getattr(settings, 'WP_FEED_ITEMS', 10)
+FEED_CACHE_TIMEOUT = getattr(settings, 'WP_FEED_CACHE_TIMEOUT', 60 * 60)
+
+FEED_TYPES = {
+    'rss': Rss201rev2Feed,
+    'atom': Atom1Feed,
+}
+
+
+class PostFeed(Feed):
+    """
+    The latest published posts, with their authors and terms loaded in
+    batch.
+    """
+
+    cache_timeout = FEED_CACHE_TIMEOUT
+    items_count = FEED_ITEMS
+    format_kwarg = 'format'
+
+    def __call__(self, request, *args, **kwargs):
+
+        feed_type = FEED_TYPES.get(kwargs.pop(self.format_kwarg, None) or 'rss')
+        if feed_type is None:
+            raise Http404('Unknown feed format.')
+
+        try:
+            obj = self.get_object(request, *args, **kwargs)
+        except ObjectDoesNotExist:
+            raise Http404('Feed object does not exist.')
+
+        (modified, stamp) = self.get_version(obj)
+        last_modified = calendar.timegm(modified.utctimetuple()) if modified else None
+        etag = hashlib.md5((u'%s|%s|%s' % (request.build_absolute_uri(), feed_type.__name__, stamp)).encode('utf-8')).hexdigest()
+
+        if not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+
+        else:
+
+            key = 'wordpress:feed:%s' % etag
+            cached = cache.get(key) if self.cache_timeout else None
+            if self.cache_timeout:
+                record_cache(cached is not None)
+
+            if cached is None:
+                # the feed instance is shared between requests, so the feed
+                # type is set on a copy
+                feed = copy.copy(self)
+                feed.feed_type = feed_type
+                feedgen = feed.get_feed(obj, request)
+                response = HttpResponse(content_type=feedgen.mime_type)
+                feedgen.write(response, 'utf-8')
+                if self.cache_timeout:
+                    cache.set(key, (response.content, feedgen.mime_type), self.cache_timeout)
+            else:
+                (content, content_type) = cached
+                response = HttpResponse(content, content_type=content_type)
+
+        response['ETag'] = quote_etag(etag)
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+
+        return response
+
+    def get_queryset(self, obj):
+        return Post.objects.published().order_by('-post_date', '-pk')
+
+    @instrumented('PostFeed.get_version')
+    def get_version(self, obj):
+        """
+        Return a tuple of the last modified datetime and a version string
+        for the items of the feed.
+        """
+        rows = list(self.get_queryset(obj).values_list('pk', 'modified', 'comment_count')[:self.items_count])
+        modified = max(row[1] for row in rows) if rows else None
+        return (modified, ','.join('%s:%s:%s' % row for row in rows))
+
+    def items(self, obj):
+        return list(self.get_queryset(obj).select_related('author').with_terms()[:self.items_count])
+
+    def title(self, obj):
+        return Option.objects.get_value('blogname')
+
+    def description(self, obj):
+        return Option.objects.get_value('blogdescription')
+
+    def link(self, obj):
+        return reverse('wp_archive_index')
+
+    def item_title(self, item):
+        return item.title
+
+    def item_description(self, item):
+        if Option.objects.get_value('rss_use_excerpt') == '1':
+            return item.summary
+        return item.content
+
+    def item_author_name(self, item):
+        return item.author.display_name
+
+    def item_pubdate(self, item):
+        return item.post_date
+
+    def item_updateddate(self, item):
+        return item.modified
+
+    def item_categories(self, item):
+        return [term.name for terms in (item.term_cache or {}).values() for term in terms]
+
+    def item_guid(self, item):
+        return item.guid
+
+    def item_guid_is_permalink(self, item):
+        return False
+
+
+class AuthorFeed(PostFeed):
+    """
+    The latest published posts of an author.
+    """
+
+    def get_object(self, request, username):
+        return User.objects.get(login=username)
+
+    def get_queryset(self, obj):
+        return super(AuthorFeed, self).get_queryset(obj).filter(author=obj)
+
+    def title(self, obj):
+        return u'%s \u00bb %s' % (Option.objects.get_value('blogname'), obj.display_name)
+
+    def link(self, obj):
+        return reverse('wp_author', args=[obj.login])
+
+
+class TaxonomyFeed(PostFeed):
+    """
+    The latest published posts with a category or tag, selected the same way
+    as TaxonomyArchive.
+    """
+
+    def get_object(self, request, taxonomy, term):
+        if taxonomy not in TAXONOMIES:
+            raise Http404
+        for obj in Term.objects.filter(slug=term)[:1]:
+            return (taxonomy, obj)
+        raise Term.DoesNotExist
+
+    def get_queryset(self, obj):
+        (taxonomy, term) = obj
+        return Post.objects.term(term.slug, taxonomy=TAXONOMIES[taxonomy]).order_by('-post_date', '-pk')
+
+    def title(self, obj):
+        return u'%s \u00bb %s' % (Option.objects.get_value('blogname'), obj[1].name)
+
+    def link(self, obj):
+        return reverse('wp_taxonomy', kwargs={'taxonomy': obj[0], 'term': obj[1].slug})
+
+
+class CommentFeed(PostFeed):
+    """
+    The latest approved comments of a post.
+    """
+
+    def get_object(self, request, year, month, day, slug):
+        post = permalinks.get_post('/'.join((year, month, day, slug)))
+        if post is None:
+            raise Post.DoesNotExist
+        return post
+
+    def get_queryset(self, obj):
+        return Comment.objects.approved().filter(post=obj).order_by('-post_date', '-pk')
+
+    @instrumented('CommentFeed.get_version')
+    def get_version(self, obj):
+        rows = list(self.get_queryset(obj).values_list('pk', 'post_date')[:self.items_count])
+        modified = max([obj.modified] + [row[1] for row in rows])
+        return (modified, '%s:%s' % (obj.modified, ','.join('%s' % row[0] for row in rows)))
+
+    def items(self, obj):
+        comments = list(self.get_queryset(obj)[:self.items_count])
+        for comment in comments:
+            comment.post = obj
+        return comments
+
+    def title(self, obj):
+        return u'Comments on: %s' % obj.title
+
+    def description(self, obj):
+        return obj.summary
+
+    def link(self, obj):
+        return obj.get_absolute_url()
+
+    def item_title(self, item):
+        return u'By: %s' % item.author_name
+
+    def item_description(self, item):
+        return item.content
+
+    def item_author_name(self, item):
+        return item.author_name
+
+    def item_pubdate(self, item):
+        return item.post_date
+
+    def item_updateddate(self, item):
+        return item.post_date
+
+    def item_categories(self, item):
+        return ()
+
+    def item_guid(self, item):
+        return item.get_absolute_url()
+
+    def item_guid_is_permalink(self, item):
+        return True
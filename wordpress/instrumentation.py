@@ -0,0 +1,230 @@
+"""
+Opt-in recording of the queries, database time and cache hits of models and
+views.
+
+Functions decorated with instrumented() attribute the queries run while they
+are active to their label, so a recording shows which manager method, batch
+loader or view ran each query:
+
+    with instrument() as recording:
+        list(Post.objects.published().with_terms()[:10])
+    recording.stats['prefetch_terms'].queries
+
+Nothing is recorded, and the decorators only cost an attribute lookup,
+unless a recording is active in the current thread. InstrumentationMiddleware
+records each request.
+"""
+
+import collections
+import functools
+import itertools
+import threading
+import time
+
+from django.db import connections
+
+_local = threading.local()
+
+
+class Stat(object):
+    """
+    Counters for one label. Queries and database time are only counted for
+    the label itself, not for instrumented calls made from it; time includes
+    them.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.time = 0.0
+
+    def __repr__(self):
+        return '<Stat calls=%i queries=%i db_time=%.4f cache=%i/%i time=%.4f>' % (
+            self.calls, self.queries, self.db_time, self.cache_hits, self.cache_misses, self.time)
+
+
+def _query_log(connection):
+    # Django 1.8 keeps queries in a bounded deque, earlier versions in a list
+    log = getattr(connection, 'queries_log', None)
+    return connection.queries if log is None else log
+
+
+class Recording(object):
+
+    def __init__(self):
+        self.stats = collections.OrderedDict()
+        self.start = time.time()
+        self.end = None
+        self._stack = ['other']
+        self._marks = {}
+        self._debug_cursors = {}
+
+    def _begin(self):
+        for connection in connections.all():
+            if hasattr(connection, 'force_debug_cursor'):
+                self._debug_cursors[connection.alias] = ('force_debug_cursor', connection.force_debug_cursor)
+                connection.force_debug_cursor = True
+            else:
+                self._debug_cursors[connection.alias] = ('use_debug_cursor', connection.use_debug_cursor)
+                connection.use_debug_cursor = True
+            self._marks[connection.alias] = len(_query_log(connection))
+
+    def _finish(self):
+        self._flush()
+        for connection in connections.all():
+            if connection.alias in self._debug_cursors:
+                (attr, value) = self._debug_cursors[connection.alias]
+                setattr(connection, attr, value)
+        self.end = time.time()
+
+    def _stat(self, label):
+        if label not in self.stats:
+            self.stats[label] = Stat()
+        return self.stats[label]
+
+    def _flush(self):
+        """
+        Attribute the queries run since the last flush to the current label.
+        """
+        stat = self._stat(self._stack[-1])
+        for connection in connections.all():
+            log = _query_log(connection)
+            mark = min(self._marks.get(connection.alias, 0), len(log))
+            for query in itertools.islice(log, mark, None):
+                stat.queries += 1
+                stat.db_time += float(query['time'])
+            self._marks[connection.alias] = len(log)
+
+    def push(self, label):
+        self._flush()
+        self._stack.append(label)
+        self._stat(label).calls += 1
+
+    def pop(self, elapsed=0.0):
+        self._flush()
+        self._stat(self._stack.pop()).time += elapsed
+
+    def cache(self, hit):
+        stat = self._stat(self._stack[-1])
+        if hit:
+            stat.cache_hits += 1
+        else:
+            stat.cache_misses += 1
+
+    @property
+    def queries(self):
+        return sum(stat.queries for stat in self.stats.values())
+
+    @property
+    def db_time(self):
+        return sum(stat.db_time for stat in self.stats.values())
+
+    @property
+    def cache_hits(self):
+        return sum(stat.cache_hits for stat in self.stats.values())
+
+    @property
+    def cache_misses(self):
+        return sum(stat.cache_misses for stat in self.stats.values())
+
+    @property
+    def time(self):
+        return (self.end or time.time()) - self.start
+
+
+def current():
+    """
+    Return the active Recording of the current thread or None.
+    """
+    return getattr(_local, 'recording', None)
+
+
+def start():
+    """
+    Start recording the current thread and return the Recording.
+    """
+    recording = Recording()
+    recording._begin()
+    recording.previous = current()
+    _local.recording = recording
+    return recording
+
+
+def stop(recording):
+    """
+    Stop a recording started with start().
+    """
+    recording._finish()
+    _local.recording = recording.previous
+
+
+class instrument(object):
+    """
+    Context manager that records the current thread while it is active.
+    """
+
+    def __enter__(self):
+        self.recording = start()
+        return self.recording
+
+    def __exit__(self, *exc_info):
+        stop(self.recording)
+
+
+def instrumented(label):
+    """
+    Decorator that attributes the queries and cache hits of a function to
+    label in the active recording.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recording = current()
+            if recording is None:
+                return func(*args, **kwargs)
+            start = time.time()
+            recording.push(label)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recording.pop(time.time() - start)
+        return wrapper
+
+    return decorator
+
+
+def metrics(recording, prefix='wordpress'):
+    """
+    Return a list of (name, value) pairs for a recording, with totals and
+    per label counts. Times are in milliseconds.
+    """
+
+    values = [
+        ('%s.queries' % prefix, recording.queries),
+        ('%s.db_time' % prefix, recording.db_time * 1000),
+        ('%s.cache_hits' % prefix, recording.cache_hits),
+        ('%s.cache_misses' % prefix, recording.cache_misses),
+        ('%s.time' % prefix, recording.time * 1000),
+    ]
+
+    for (label, stat) in recording.stats.items():
+        values.extend([
+            ('%s.%s.calls' % (prefix, label), stat.calls),
+            ('%s.%s.queries' % (prefix, label), stat.queries),
+            ('%s.%s.db_time' % (prefix, label), stat.db_time * 1000),
+        ])
+
+    return values
+
+
+def record_cache(hit):
+    """
+    Count a cache hit or miss against the current label, if recording.
+    """
+    recording = current()
+    if recording is not None:
+        recording.cache(hit)
@@ -0,0 +1,115 @@
+import json
+import sys
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from wordpress import benchmark
+
+
+class Command(NoArgsCommand):
+
+    help = ("Generate a synthetic WordPress database and benchmark the views, template tags and "
+            "export commands against it. WP_DATABASE must be an SQLite database.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--generate', dest='generate', action='store_true', default=False,
+            help='Regenerate the database even if the WordPress tables exist. Requires --force.'),
+        make_option('--force', dest='force', action='store_true', default=False,
+            help='Allow --generate to drop the existing WordPress tables and their rows.'),
+        make_option('--posts', dest='posts', type='int', default=1000,
+            help='Number of posts to generate. Defaults to 1000.'),
+        make_option('--meta', dest='meta', type='int', default=5,
+            help='Number of meta values per post. Defaults to 5.'),
+        make_option('--terms', dest='terms', type='int', default=50,
+            help='Number of terms, half categories and half tags. Defaults to 50.'),
+        make_option('--comments', dest='comments', type='int', default=3,
+            help='Number of comments per published post. Defaults to 3.'),
+        make_option('--users', dest='users', type='int', default=20,
+            help='Number of users. Defaults to 20.'),
+        make_option('--seed', dest='seed', type='int', default=0,
+            help='Random seed for the generated content. Defaults to 0.'),
+        make_option('--repeat', dest='repeat', type='int', default=5,
+            help='Number of times each benchmark is run. Defaults to 5.'),
+        make_option('--only', dest='only', action='append', default=[],
+            help='Only run benchmarks whose names start with this. May be given more than once.'),
+        make_option('--load', dest='load', action='store_true', default=False,
+            help='Also measure view throughput with sequential and concurrent lookups.'),
+        make_option('--requests', dest='requests', type='int', default=200,
+            help='Number of requests served by the load benchmark. Defaults to 200.'),
+        make_option('--workers', dest='workers', type='int', default=8,
+            help='Number of threads serving requests in the load benchmark. Defaults to 8.'),
+        make_option('--latency', dest='latency', type='float', default=5,
+            help='Milliseconds added to each query in the load benchmark. Defaults to 5.'),
+        make_option('--lookup-threads', dest='lookup_threads', type='int', default=4,
+            help='Size of the concurrent lookup pool in the load benchmark. Defaults to 4.'),
+        make_option('-o', '--output', dest='output', default=None,
+            help='File to write the JSON results to. Defaults to stdout.'),
+    )
+
+    def handle_noargs(self, **options):
+
+        if benchmark.connection().vendor != 'sqlite':
+            raise CommandError("wpbenchmark creates tables and must be run against an SQLite database; "
+                               "point WP_DATABASE at one in a separate settings module")
+
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        verbose = int(options.get('verbosity', 1)) > 0
+
+        if options['generate'] and benchmark.tables_exist() and not options['force']:
+            raise CommandError("--generate drops the WordPress tables in %s and all their rows; "
+                               "pass --force as well to do so" % benchmark.connection().settings_dict['NAME'])
+
+        if options['generate'] or not benchmark.tables_exist():
+            if verbose:
+                self.stderr.write("generating %i posts..." % options['posts'])
+            try:
+                counts = benchmark.generate(options['posts'], options['meta'], options['terms'],
+                                            options['comments'], options['users'], options['seed'],
+                                            force=options['force'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            if verbose:
+                for (table, count) in sorted(counts.items()):
+                    self.stderr.write("%s: %i rows" % (table, count))
+
+        results = benchmark.run(options['repeat'], options['only'])
+
+        if options['load']:
+            try:
+                results['load'] = benchmark.load(options['requests'], options['workers'], options['latency'] / 1000.0,
+                                                 options['lookup_threads'], options['only'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        if verbose:
+            for (name, result) in sorted(results['benchmarks'].items()):
+                if 'error' in result:
+                    self.stderr.write("%s: %s" % (name, result['error']))
+                else:
+                    self.stderr.write("%s: %i queries, %.1fms" % (name, result['queries'], result['time_min'] * 1000))
+            comparison = results.get('term_comparison')
+            if comparison:
+                self.stderr.write("PostManager.term() vs. the pre-0.11 subquery, first page of tag %s (%i posts):" % (
+                    comparison['term'], comparison['posts']))
+                for name in ('join', 'legacy'):
+                    result = comparison[name]
+                    self.stderr.write("  %s: %.2fms median, %.2fms min" % (
+                        name, result['time_median'] * 1000, result['time_min'] * 1000))
+                    for line in result['plan']:
+                        self.stderr.write("    %s" % line)
+            for mode in ('sequential', 'concurrent'):
+                if mode in results.get('load', {}):
+                    result = results['load'][mode]
+                    self.stderr.write("load %s: %.0f requests/sec, %.1fms mean latency" % (
+                        mode, result['requests_per_second'], result['latency_mean'] * 1000))
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                stream.write(output + '\n')
+        else:
+            sys.stdout.write(output + '\n')
@@ -0,0 +1,71 @@
+import json
+import os
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from wordpress import export
+from wordpress.management.commands.wpexport import open_output
+
+
+def read_state(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(path, watermark):
+    # write and rename so an interruption never leaves a partial state file
+    tmp = '%s.tmp' % path
+    with open(tmp, 'w') as f:
+        json.dump(watermark, f)
+    os.rename(tmp, path)
+
+
+class Command(NoArgsCommand):
+
+    help = ("Write the posts and comments changed since the last run as JSON lines, with deleted "
+            "records for posts that were trashed or unpublished.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--state', dest='state', default=None,
+            help='File the watermark is kept in. Without it every post is written.'),
+        make_option('--post-type', dest='post_types', action='append', default=[],
+            help='Type of posts to include. May be given more than once. Defaults to post, page and attachment.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=500,
+            help='Number of posts loaded per query. Defaults to 500.'),
+        make_option('-o', '--output', dest='output', default=None,
+            help='File to write to. Defaults to stdout.'),
+    )
+
+    def handle_noargs(self, **options):
+
+        state = options['state']
+        post_types = options['post_types'] or export.CHANGE_POST_TYPES
+
+        try:
+            watermark = read_state(state) if state else None
+        except ValueError:
+            raise CommandError("%s is not a valid state file" % state)
+
+        stream = open_output(options['output'])
+        writer = export.JSONLWriter(stream)
+        count = 0
+
+        try:
+            for (records, watermark) in export.iter_changes(watermark, post_types, options['chunk_size']):
+                for record in records:
+                    writer.write_object(record)
+                count += len(records)
+                # only advance the watermark once the chunk is written
+                stream.flush()
+                if state:
+                    write_state(state, watermark)
+        finally:
+            stream.flush()
+            if options['output']:
+                stream.close()
+
+        if int(options.get('verbosity', 1)) > 0:
+            self.stderr.write("wrote %i changes" % count)
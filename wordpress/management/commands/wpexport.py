@@ -1,20 +1,83 @@
+import codecs
+import datetime
 import sys
+import time
+from optparse import make_option
 
-from django.core.management.base import NoArgsCommand
-from django.template.loader import render_to_string
+from django.core.management.base import CommandError, NoArgsCommand
 
-from wordpress.models import Post, Author
+from wordpress import export
 import wordpress
 
 
+def open_output(path=None):
+    if path:
+        return codecs.open(path, 'w', 'utf-8')
+    return codecs.getwriter('utf-8')(getattr(sys.stdout, 'buffer', sys.stdout))
+
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise CommandError("dates must be in YYYY-MM-DD format")
+
+
 class Command(NoArgsCommand):
 
+    help = "Dump published posts in WXR or JSON lines format."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--since', dest='since', default=None,
+            help='Only export posts published on or after this date (YYYY-MM-DD).'),
+        make_option('--post-type', dest='post_type', default='post',
+            help='Type of posts to export. Defaults to post.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=500,
+            help='Number of posts loaded per query. Defaults to 500.'),
+        make_option('--format', dest='format', default='wxr', choices=sorted(export.WRITERS),
+            help='Output format, wxr or jsonl. Defaults to wxr.'),
+        make_option('-o', '--output', dest='output', default=None,
+            help='File to write to. Defaults to stdout.'),
+        make_option('--workers', dest='workers', type='int', default=1,
+            help='Number of worker processes to export with. Requires --output.'),
+        make_option('--split', dest='split', action='store_true', default=False,
+            help='Leave the numbered shard files written by workers instead of stitching them together.'),
+    )
+
     def handle_noargs(self, **options):
 
-        context = {
-            'authors': Author.objects.all(),
-            'posts': Post.objects.published(),
-            'generator': 'http://github.com/sunlightlabs/django-wordpress#%s' % wordpress.__version__,
-        }
+        since = parse_date(options['since']) if options['since'] else None
+        generator = 'http://github.com/sunlightlabs/django-wordpress#%s' % wordpress.__version__
+
+        start = time.time()
+
+        if options['workers'] > 1:
+
+            if not options['output']:
+                raise CommandError("--output is required when using more than one worker")
+
+            def report(shard, count, seconds):
+                self.stderr.write("shard %i: %i posts in %.1fs (%.0f posts/sec)" % (
+                    shard, count, seconds, count / seconds if seconds else 0))
+
+            count = export.export_sharded(options['output'], options['workers'],
+                post_type=options['post_type'], since=since, format=options['format'],
+                chunk_size=options['chunk_size'], generator=generator,
+                split=options['split'], report=report)
+
+        else:
+
+            qs = export.export_queryset(options['post_type'], since)
+
+            stream = open_output(options['output'])
+            try:
+                count = export.export(stream, qs, options['format'], options['chunk_size'], generator)
+            finally:
+                stream.flush()
+                if options['output']:
+                    stream.close()
 
-        sys.stdout.write(render_to_string("wordpress/wxr.xml", context))
+        seconds = time.time() - start
+        if int(options.get('verbosity', 1)) > 0:
+            self.stderr.write("exported %i posts in %.1fs (%.0f posts/sec)" % (
+                count, seconds, count / seconds if seconds else 0))
@@ -1,24 +1,66 @@
 import csv
+import io
+import json
 import sys
+from optparse import make_option
 
 from django.core.management.base import NoArgsCommand
-from wordpress.models import User
+from wordpress.export import iter_authors
 
 HEADERS = ("id", "username", "display_name", "email")
 
 
+def _csv_value(value):
+    # the Python 2 csv module only writes byte strings
+    if str is bytes and isinstance(value, type(u'')):
+        return value.encode('utf-8')
+    return value
+
+
 class Command(NoArgsCommand):
 
+    help = "Export authors as CSV or JSON lines."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--format', dest='format', default='csv', choices=('csv', 'jsonl'),
+            help='Output format, csv or jsonl. Defaults to csv.'),
+        make_option('--meta', dest='meta', action='append', default=[],
+            help='User meta key to include. May be given more than once.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=1000,
+            help='Number of users loaded per query. Defaults to 1000.'),
+        make_option('-o', '--output', dest='output', default=None,
+            help='File to write to. Defaults to stdout.'),
+    )
+
     def handle_noargs(self, **options):
 
-        writer = csv.writer(sys.stdout)
-        writer.writerow(HEADERS)
-
-        for author in User.objects.all():
-            row = (
-                author.pk,
-                author.login,
-                author.display_name,
-                author.email,
-            )
-            writer.writerow(row)
+        meta_keys = options['meta']
+
+        if options['output'] and str is bytes:
+            stream = open(options['output'], 'wb')
+        elif options['output']:
+            # the csv module writes its own \r\n line endings
+            stream = io.open(options['output'], 'w', encoding='utf-8', newline='')
+        else:
+            stream = sys.stdout
+
+        try:
+
+            if options['format'] == 'jsonl':
+                for (pk, login, display_name, email, meta) in iter_authors(options['chunk_size'], meta_keys):
+                    obj = {'id': pk, 'username': login, 'display_name': display_name, 'email': email}
+                    if meta_keys:
+                        obj['meta'] = meta
+                    stream.write(json.dumps(obj) + '\n')
+
+            else:
+                writer = csv.writer(stream)
+                writer.writerow(HEADERS + tuple(meta_keys))
+                for (pk, login, display_name, email, meta) in iter_authors(options['chunk_size'], meta_keys):
+                    row = (pk, login, display_name, email) + tuple(meta.get(key, '') for key in meta_keys)
+                    writer.writerow([_csv_value(value) for value in row])
+
+        finally:
+            stream.flush()
+            if options['output']:
+                stream.close()
@@ -0,0 +1,25 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from wordpress.permalinks import permalinks
+
+
+class Command(NoArgsCommand):
+
+    help = "Build the permalink index of posts and attachments."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int', default=1000,
+            help='Number of rows loaded per query. Defaults to 1000.'),
+    )
+
+    def handle_noargs(self, **options):
+
+        start = time.time()
+        count = permalinks.rebuild(options['chunk_size'])
+        seconds = time.time() - start
+
+        if int(options.get('verbosity', 1)) > 0:
+            self.stderr.write("indexed %i posts and attachments in %.1fs" % (count, seconds))
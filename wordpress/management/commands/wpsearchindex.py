@@ -0,0 +1,36 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from wordpress.search import get_index
+
+
+class Command(NoArgsCommand):
+
+    help = "Build or update the full-text search index at WP_SEARCH_INDEX."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--rebuild', dest='rebuild', action='store_true', default=False,
+            help='Empty the index and index every post.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=500,
+            help='Number of posts loaded per query. Defaults to 500.'),
+    )
+
+    def handle_noargs(self, **options):
+
+        index = get_index()
+        if index is None:
+            raise CommandError("set WP_SEARCH_INDEX to the path of the search index")
+
+        start = time.time()
+
+        if options['rebuild']:
+            count = index.rebuild(options['chunk_size'])
+        else:
+            count = index.refresh(options['chunk_size'])
+
+        seconds = time.time() - start
+        if int(options.get('verbosity', 1)) > 0:
+            self.stderr.write("indexed %i posts in %.1fs (%.0f posts/sec)" % (
+                count, seconds, count / seconds if seconds else 0))
@@ -0,0 +1,41 @@
+import time
+from optparse import make_option
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import CommandError, NoArgsCommand
+
+from wordpress import sitemaps
+
+
+class Command(NoArgsCommand):
+
+    help = "Generate the sitemap index and sitemaps of posts, terms and authors."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--base-url', dest='base_url', default=sitemaps.SITEMAP_BASE_URL,
+            help='Scheme and host of the site, such as https://example.com. Defaults to WP_SITEMAP_BASE_URL.'),
+        make_option('--limit', dest='limit', type='int', default=sitemaps.SITEMAP_LIMIT,
+            help='Maximum number of URLs per sitemap. Defaults to WP_SITEMAP_LIMIT or 50000.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=5000,
+            help='Number of rows loaded per query. Defaults to 5000.'),
+    )
+
+    def handle_noargs(self, **options):
+
+        if not options['base_url']:
+            raise CommandError("pass --base-url or set WP_SITEMAP_BASE_URL")
+        if not 0 < options['limit'] <= 50000:
+            raise CommandError("--limit must be between 1 and 50000")
+
+        try:
+            sitemaps.check_storage()
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        start = time.time()
+        written = sitemaps.generate(options['base_url'], options['limit'], options['chunk_size'])
+        seconds = time.time() - start
+
+        if int(options.get('verbosity', 1)) > 0:
+            count = sum(count for (name, count) in written[:-1])
+            self.stderr.write("wrote %i URLs in %i sitemaps in %.1fs" % (count, len(written) - 1, seconds))
@@ -0,0 +1,107 @@
+import importlib
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import six
+from wordpress import instrumentation, router
+
+INSTRUMENTATION_HEADERS = getattr(settings, "WP_INSTRUMENTATION_HEADERS", True)
+INSTRUMENTATION_CALLBACK = getattr(settings, "WP_INSTRUMENTATION_CALLBACK", None)
+READ_PIN_COOKIE = getattr(settings, "WP_READ_PIN_COOKIE", "wp_read_pin")
+
+logger = logging.getLogger('wordpress.instrumentation')
+
+
+def view_name(view_func):
+    """
+    Return the dotted name of the view class or function of a view.
+    """
+    # as_view() sets view_class from Django 1.9 and copies the name and
+    # module of the class onto the view function before that; feeds are
+    # callable instances
+    view = getattr(view_func, 'view_class', view_func)
+    if not hasattr(view, '__name__'):
+        view = view.__class__
+    return '%s.%s' % (view.__module__, view.__name__)
+
+
+class ReplicaPinningMiddleware(object):
+    """
+    Keeps the reads of a request on WP_DATABASE once the request has written
+    to it, and checks the replicas it read from if it raises a database
+    error. Only needed when WP_READ_DATABASES is set.
+
+    A request that writes sets a WP_READ_PIN_COOKIE cookie that lasts
+    WP_READ_PIN_SECONDS seconds, and the client's requests that send it
+    back read from WP_DATABASE too, whichever thread or process serves
+    them.
+    """
+
+    def process_request(self, request):
+        router.start_request(pinned=READ_PIN_COOKIE in request.COOKIES)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, DatabaseError):
+            router.replica_failed()
+
+    def process_response(self, request, response):
+        if router.end_request():
+            response.set_cookie(READ_PIN_COOKIE, '1', max_age=router.READ_PIN_SECONDS, httponly=True)
+        return response
+
+
+class InstrumentationMiddleware(object):
+    """
+    Records the queries, database time and cache hits of each request and
+    attributes them to the view and to instrumented model methods.
+
+    Totals are added to the response as X-WP-* headers unless
+    WP_INSTRUMENTATION_HEADERS is False and logged to the
+    wordpress.instrumentation logger. If WP_INSTRUMENTATION_CALLBACK is set
+    to a callable or its dotted path, it is called with the name and value
+    of each metric, as returned by instrumentation.metrics().
+    """
+
+    def __init__(self):
+        self.callback = INSTRUMENTATION_CALLBACK
+        if isinstance(self.callback, six.string_types):
+            (module, name) = self.callback.rsplit('.', 1)
+            self.callback = getattr(importlib.import_module(module), name)
+
+    def process_request(self, request):
+        request.wp_recording = instrumentation.start()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.wp_recording.push(view_name(view_func))
+
+    def process_response(self, request, response):
+
+        recording = getattr(request, 'wp_recording', None)
+        if recording is None:
+            return response
+
+        instrumentation.stop(recording)
+        del request.wp_recording
+
+        if INSTRUMENTATION_HEADERS:
+            response['X-WP-Queries'] = str(recording.queries)
+            response['X-WP-DB-Time'] = '%.1f' % (recording.db_time * 1000)
+            response['X-WP-Cache-Hits'] = str(recording.cache_hits)
+            response['X-WP-Cache-Misses'] = str(recording.cache_misses)
+
+        logger.info('%s %s %s queries=%i db=%.1fms cache=%i/%i time=%.1fms %s',
+                    request.method, request.path, response.status_code, recording.queries,
+                    recording.db_time * 1000, recording.cache_hits, recording.cache_misses,
+                    recording.time * 1000,
+                    ' '.join('%s:%i' % (label, stat.queries) for (label, stat) in recording.stats.items()
+                             if stat.queries))
+
+        if self.callback is not None:
+            try:
+                for (name, value) in instrumentation.metrics(recording):
+                    self.callback(name, value)
+            except Exception:
+                logger.exception('instrumentation callback failed')
+
+        return response
@@ -1,9 +1,24 @@
 import collections
-import datetime
+import functools
+import hashlib
+import itertools
+import time
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
+from django.utils import six
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+from wordpress import serialize
+from wordpress.concurrency import run_concurrently
+from wordpress.instrumentation import current, instrumented, record_cache
 
 
 STATUS_CHOICES = (
@@ -31,6 +46,9 @@ USER_STATUS_CHOICES = (
 
 READ_ONLY = getattr(settings, "WP_READ_ONLY", True)
 TABLE_PREFIX = getattr(settings, "WP_TABLE_PREFIX", "wp")
+OPTION_CACHE_TIMEOUT = getattr(settings, "WP_OPTION_CACHE_TIMEOUT", 300)
+TAXONOMY_CACHE_TIMEOUT = getattr(settings, "WP_TAXONOMY_CACHE_TIMEOUT", 300)
+EXCERPT_LENGTH = getattr(settings, "WP_EXCERPT_LENGTH", 55)
 
 
 #
@@ -90,20 +108,131 @@ class WordPressModel(models.Model):
         super(WordPressModel, self).delete()
 
 
+class SerializedValueMixin(object):
+    """
+    Provides access to PHP serialized values stored in the value field.
+    """
+
+    @property
+    def decoded_value(self):
+        """
+        The value decoded from PHP serialize() format. Values that are not
+        serialized are returned as is. The decoded value is memoized until
+        the raw value changes.
+        """
+        memo = getattr(self, '_decoded_value', None)
+        if memo is None or memo[0] is not self.value:
+            memo = (self.value, serialize.maybe_loads(self.value))
+            self._decoded_value = memo
+        return memo[1]
+
+    @decoded_value.setter
+    def decoded_value(self, value):
+        """
+        Store a value the way WordPress's maybe_serialize() does: arrays,
+        and strings that would otherwise be decoded, are serialized, True
+        is stored as "1", False and None as "" and numbers as text.
+        """
+
+        if isinstance(value, bool) or value is None:
+            value = '1' if value else ''
+        elif isinstance(value, six.integer_types + (float,)):
+            value = six.text_type(value)
+
+        if isinstance(value, (list, tuple, dict)):
+            self.value = serialize.dumps(value)
+        elif isinstance(value, six.string_types) and serialize.maybe_loads(value) is not value:
+            # it would be decoded when read back, so it is stored as a serialized string
+            self.value = serialize.dumps(value)
+        else:
+            self.value = value
+
+        self._decoded_value = (self.value, value)
+
+
 #
 # WordPress models
 #
 
 class OptionManager(WordPressManager):
+    """
+    Caches option values in process and in the Django cache.
+
+    All autoloaded options are loaded with a single query, just as WordPress
+    does. Other options are looked up and cached one at a time.
+    """
+
+    def __init__(self):
+        super(OptionManager, self).__init__()
+        self._autoload = None
+        self._autoload_expires = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_key(self, name=None):
+        if name is None:
+            return 'wordpress:%s:options:autoload' % TABLE_PREFIX
+        digest = hashlib.md5(name.encode('utf-8')).hexdigest()
+        return 'wordpress:%s:options:%s' % (TABLE_PREFIX, digest)
+
+    def autoloaded(self):
+        """
+        Return a dict of all autoloaded option names and values.
+        """
+
+        now = time.time()
+
+        if self._autoload is None or now >= self._autoload_expires:
+
+            options = cache.get(self._cache_key())
+            record_cache(options is not None)
+
+            if options is None:
+                self.misses += 1
+                options = dict(self.filter(autoload='yes').values_list('name', 'value'))
+                cache.set(self._cache_key(), options, OPTION_CACHE_TIMEOUT)
+
+            self._autoload = options
+            self._autoload_expires = now + OPTION_CACHE_TIMEOUT
+
+        return self._autoload
+
+    @instrumented('OptionManager.get_value')
     def get_value(self, name):
+
+        options = self.autoloaded()
+        if name in options:
+            self.hits += 1
+            return options[name]
+
+        cached = cache.get(self._cache_key(name))
+        record_cache(cached is not None)
+        if cached is not None:
+            self.hits += 1
+            return cached[0]
+
+        self.misses += 1
         try:
-            o = self.get(name=name)
-            return o.value
+            value = self.get(name=name).value
         except ObjectDoesNotExist:
-            pass
+            value = None
+        cache.set(self._cache_key(name), [value], OPTION_CACHE_TIMEOUT)
+        return value
+
+    def invalidate(self, name=None):
+        """
+        Clear cached autoloaded options and, if given, a single cached option.
+        """
+        self._autoload = None
+        cache.delete(self._cache_key())
+        if name is not None:
+            cache.delete(self._cache_key(name))
 
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
 
-class Option(WordPressModel):
+
+class Option(SerializedValueMixin, WordPressModel):
 
     objects = OptionManager()
 
@@ -120,6 +249,14 @@ class Option(WordPressModel):
     def __unicode__(self):
         return u"%s: %s" % (self.name, self.value)
 
+    def save(self, **kwargs):
+        super(Option, self).save(**kwargs)
+        Option.objects.invalidate(self.name)
+
+    def delete(self, **kwargs):
+        super(Option, self).delete(**kwargs)
+        Option.objects.invalidate(self.name)
+
 
 class User(WordPressModel):
     """
@@ -147,7 +284,7 @@ class User(WordPressModel):
         return self.display_name
 
 
-class UserMeta(WordPressModel):
+class UserMeta(SerializedValueMixin, WordPressModel):
     """
     Meta information about a user.
     """
@@ -196,55 +333,339 @@ class Link(WordPressModel):
         return self.visible == 'Y'
 
 
+#
+# Batch loaders
+#
+
+@instrumented('prefetch_terms')
+def prefetch_terms(posts):
+    """
+    Fill the term cache of each post using a fixed number of queries.
+    """
+
+    posts = [post for post in posts if post.term_cache is None]
+    if not posts:
+        return
+
+    for post in posts:
+        post.term_cache = collections.defaultdict(list)
+
+    rels = TermTaxonomyRelationship.objects.filter(object__in=[post.pk for post in posts])
+    rels = list(rels.values_list('object_id', 'term_taxonomy_id', 'order'))
+
+    taxonomies = {}
+    if rels:
+        tx_ids = set(tt_id for (obj_id, tt_id, order) in rels)
+        for tax in Taxonomy.objects.filter(pk__in=tx_ids).select_related('term'):
+            if tax.term is not None:
+                taxonomies[tax.pk] = tax
+
+    by_post = collections.defaultdict(list)
+    for (obj_id, tt_id, order) in rels:
+        if tt_id in taxonomies:
+            tax = taxonomies[tt_id]
+            by_post[obj_id].append((order, tax.term.name, tax))
+
+    for post in posts:
+        # taxonomies don't compare, so ties on order and name are broken by ID
+        for (order, name, tax) in sorted(by_post[post.pk], key=lambda t: (t[0], t[1], t[2].pk)):
+            post.term_cache[tax.name].append(tax.term)
+
+
+@instrumented('prefetch_children')
+def _prefetch_children(posts, cache_attr, **filters):
+    posts = [post for post in posts if getattr(post, cache_attr) is None]
+    if not posts:
+        return
+
+    children = collections.defaultdict(list)
+    for child in Post.objects.filter(parent_id__in=[post.pk for post in posts], **filters):
+        children[child.parent_id].append(child)
+
+    for post in posts:
+        setattr(post, cache_attr, children[post.pk])
+
+
+def prefetch_children(posts):
+    """
+    Fill the child cache of each post with a single query.
+    """
+    _prefetch_children(posts, 'child_cache')
+
+
+def prefetch_attachments(posts):
+    """
+    Fill the attachment cache of each post with a single query.
+    """
+    _prefetch_children(posts, 'attachment_cache', post_type='attachment')
+
+
+@instrumented('prefetch_meta')
+def prefetch_meta(posts, keys=None):
+    """
+    Fill the meta cache of each post with a single query.
+
+    If keys are given, only meta with those keys is loaded.
+    """
+
+    posts = [post for post in posts if post.meta_cache is None or not post.meta_cache.complete]
+    if not posts:
+        return
+
+    qs = PostMeta.objects.filter(post__in=[post.pk for post in posts])
+    if keys is not None:
+        qs = qs.filter(key__in=keys)
+
+    values = collections.defaultdict(lambda: collections.defaultdict(list))
+    for (post_id, key, value) in qs.order_by('id').values_list('post_id', 'key', 'value'):
+        values[post_id][key].append(value)
+
+    for post in posts:
+        if post.meta_cache is None:
+            post.meta_cache = PostMetaDict(post)
+        post.meta_cache.update(values[post.pk], keys)
+
+
+#
+# Post managers
+#
+
+class PostQuerySet(models.query.QuerySet):
+    """
+    QuerySet that batch loads related WordPress data as results are fetched.
+
+    Loaders are run once per chunk of results so that a page of posts costs
+    a fixed number of queries instead of one or more queries per post.
+    """
+
+    chunk_size = 100
+
+    def __init__(self, *args, **kwargs):
+        super(PostQuerySet, self).__init__(*args, **kwargs)
+        self._batch_loaders = {}
+        self._label = None
+
+    def _clone(self, *args, **kwargs):
+        c = super(PostQuerySet, self)._clone(*args, **kwargs)
+        c._batch_loaders = dict(self._batch_loaders)
+        c._label = self._label
+        return c
+
+    def _with_loader(self, loader, **kwargs):
+        c = self._clone()
+        c._batch_loaders[loader] = kwargs
+        return c
+
+    def labelled(self, label):
+        """
+        Attribute the queries that fetch the results to label in the active
+        recording. Querysets are lazy, so this is where their queries run,
+        not where they are built.
+        """
+        c = self._clone()
+        c._label = label
+        return c
+
+    def iterator(self):
+        results = super(PostQuerySet, self).iterator()
+        if self._batch_loaders:
+            results = self._batch_iterator(results)
+        if self._label is not None and current() is not None:
+            results = self._labelled_iterator(results)
+        return results
+
+    def _labelled_iterator(self, results):
+        fetch = instrumented(self._label)(lambda: list(itertools.islice(results, self.chunk_size)))
+        while True:
+            chunk = fetch()
+            for obj in chunk:
+                yield obj
+            if len(chunk) < self.chunk_size:
+                break
+
+    def _batch_iterator(self, results):
+        while True:
+            chunk = list(itertools.islice(results, self.chunk_size))
+            if not chunk:
+                break
+            posts = [obj for obj in chunk if isinstance(obj, Post)]
+            if posts:
+                run_concurrently(*[functools.partial(loader, posts, **kwargs)
+                                   for (loader, kwargs) in self._batch_loaders.items()])
+            for obj in chunk:
+                yield obj
+
+    def with_terms(self):
+        """
+        Load the terms of all fetched posts in a fixed number of queries.
+        """
+        return self._with_loader(prefetch_terms)
+
+    def with_children(self):
+        """
+        Load the child posts of all fetched posts in a single query.
+        """
+        return self._with_loader(prefetch_children)
+
+    def with_attachments(self):
+        """
+        Load only the attachments of all fetched posts in a single query.
+        """
+        return self._with_loader(prefetch_attachments)
+
+    def with_meta(self, *keys):
+        """
+        Load the meta of all fetched posts in a single query.
+
+        If keys are given, only meta with those keys is loaded.
+        """
+        keys = set(keys) or None
+        if keys is not None and prefetch_meta in self._batch_loaders:
+            loaded = self._batch_loaders[prefetch_meta]['keys']
+            keys = None if loaded is None else keys | loaded
+        return self._with_loader(prefetch_meta, keys=keys)
+
+    def listing(self, content=False, preview_length=2000):
+        """
+        Defer the large text columns that list pages don't show.
+
+        Unless content is True, post content is deferred as well and the
+        first preview_length characters of it are selected instead for
+        posts without an excerpt, so that Post.summary can be built without
+        loading the full content.
+        """
+
+        qs = self.defer('content_filtered', 'to_ping', 'pinged')
+
+        if not content:
+            table = Post._meta.db_table
+            qs = qs.defer('content').extra(
+                select={'content_preview': "CASE WHEN %s.post_excerpt = '' THEN SUBSTR(%s.post_content, 1, %%s) ELSE '' END" % (table, table)},
+                select_params=(int(preview_length),))
+
+        return qs
+
+
 class PostManager(WordPressManager):
     """
     Provides convenience methods for filtering posts by status.
     """
 
+    def get_queryset(self):
+        return PostQuerySet(self.model, using=self._db)
+    get_query_set = get_queryset
+
+    def with_terms(self):
+        return self.get_queryset().with_terms()
+
+    def with_children(self):
+        return self.get_queryset().with_children()
+
+    def with_attachments(self):
+        return self.get_queryset().with_attachments()
+
+    def with_meta(self, *keys):
+        return self.get_queryset().with_meta(*keys)
+
+    def listing(self, content=False, preview_length=2000):
+        return self.get_queryset().listing(content, preview_length)
+
     def _by_status(self, status, post_type='post'):
-        return self.filter(status=status, post_type=post_type)\
-            .select_related().prefetch_related('meta')
+        return self.filter(status=status, post_type=post_type).select_related()
 
     def drafts(self, post_type='post'):
-        return self._by_status('draft', post_type)
+        return self._by_status('draft', post_type).labelled('PostManager.drafts')
 
     def private(self, post_type='post'):
-        return self._by_status('private', post_type)
+        return self._by_status('private', post_type).labelled('PostManager.private')
 
     def published(self, post_type='post'):
-        return self._by_status('publish', post_type)
-
-    def term(self, terms, taxonomy='post_tag'):
+        return self._by_status('publish', post_type).labelled('PostManager.published')
+
+    def _term_lookup(self, taxonomy, slugs, include_children=False):
+        if not include_children:
+            return {'terms__name': taxonomy, 'terms__term__slug__in': slugs}
+        tree = Taxonomy.objects.tree(taxonomy)
+        ids = set()
+        for slug in slugs:
+            for tt_id in tree.ids_for_slug(slug):
+                ids.add(tt_id)
+                ids.update(tree.descendants(tt_id))
+        return {'terms__pk__in': ids}
+
+    def term(self, terms, taxonomy='post_tag', operator='or', include_children=False):
         """
-        @arg terms Can either be a string (name of the term) or an list of term names.
+        @arg terms Can either be a string (slug of the term), a list of term slugs or
+                   a dict mapping taxonomies to term slugs or lists of term slugs.
+        @arg operator Either 'or' to match posts with any of the terms or 'and' to
+                      match posts with all of them.
+        @arg include_children Also match posts with descendants of the terms, as
+                              WordPress does for hierarchical taxonomies.
         """
 
-        terms = terms if isinstance(terms, (list, tuple)) else [terms]
+        if not isinstance(terms, dict):
+            terms = {taxonomy: terms}
 
-        try:
-            tx = Taxonomy.objects.filter(name=taxonomy, term__slug__in=terms)
-            post_ids = TermTaxonomyRelationship.objects.filter(term_taxonomy__in=tx).values_list('object_id', flat=True)
+        lookups = {}
+        for (tax, slugs) in terms.items():
+            slugs = slugs if isinstance(slugs, (list, tuple, set)) else [slugs]
+            if slugs:
+                lookups[tax] = set(slugs)
 
-            return self.published().filter(pk__in=post_ids)
-        except Taxonomy.DoesNotExist:
+        if not lookups:
             return self.none()
 
-    def from_path(self, path):
+        qs = self.published()
 
-        (ymd, slug) = path.strip('/').rsplit('/', 1)
+        if operator == 'and':
+            # each filter() call adds its own join, one per term
+            for (tax, slugs) in lookups.items():
+                for slug in slugs:
+                    qs = qs.filter(**self._term_lookup(tax, [slug], include_children))
 
-        start_date = datetime.datetime.strptime(ymd, "%Y/%m/%d")
-        end_date = start_date + datetime.timedelta(days=1) - datetime.timedelta(minutes=1)
+        elif operator == 'or':
+            q = functools.reduce(lambda a, b: a | b, [
+                models.Q(**self._term_lookup(tax, slugs, include_children)) for (tax, slugs) in lookups.items()])
+            qs = qs.filter(q)
 
-        params = {
-            'post_date__range': (start_date, end_date),
-            'slug': slug,
-        }
+        else:
+            raise ValueError("operator must be 'or' or 'and'")
 
-        try:
-            return self.published().get(**params)
-        except ObjectDoesNotExist:
-            pass  # fall through to return None
+        if include_children or (operator == 'or' and sum(len(slugs) for slugs in lookups.values()) > 1):
+            qs = qs.distinct()
+
+        return qs.labelled('PostManager.term')
+
+    def search(self, query, queryset=None):
+        """
+        Return the published posts matching all words of query.
+
+        If WP_SEARCH_INDEX is set and the index has been built, this is a
+        wordpress.search.SearchResults, best match first. Otherwise it is a
+        queryset that matches each word against the title and content.
+        """
+
+        from wordpress.search import SearchResults, get_index
+
+        qs = (self.published() if queryset is None else queryset).labelled('PostManager.search')
+        index = get_index()
+
+        if index is not None and index.is_ready():
+            return SearchResults(index, query, qs)
+
+        for word in query.split():
+            qs = qs.filter(models.Q(title__icontains=word) | models.Q(content__icontains=word))
+        return qs
+
+    @instrumented('PostManager.from_path')
+    def from_path(self, path):
+        """
+        Return the published post at a permalink path or None.
+
+        Paths are resolved through the index in wordpress.permalinks.
+        """
+        from wordpress.permalinks import permalinks
+        return permalinks.get_post(path, self.published())
 
 
 class TermTaxonomyRelationship(WordPressModel):
@@ -280,7 +701,9 @@ class Post(WordPressModel):
     content = models.TextField(db_column='post_content')
     content_filtered = models.TextField(db_column='post_content_filtered')
     post_date = models.DateTimeField(db_column='post_date')
+    post_date_gmt = models.DateTimeField(db_column='post_date_gmt')
     modified = models.DateTimeField(db_column='post_modified')
+    modified_gmt = models.DateTimeField(db_column='post_modified_gmt')
 
     # comment stuff
     comment_status = models.CharField(max_length=20, choices=STATUS_CHOICES)
@@ -305,6 +728,8 @@ class Post(WordPressModel):
 
     term_cache = None
     child_cache = None
+    attachment_cache = None
+    meta_cache = None
 
     class Meta:
         db_table = '%s_posts' % TABLE_PREFIX
@@ -320,6 +745,8 @@ class Post(WordPressModel):
             self.parent_id = 0
         super(Post, self).save(**kwargs)
         self.child_cache = None
+        self.attachment_cache = None
+        self.meta_cache = None
         self.term_cache = None
 
     @models.permalink
@@ -333,30 +760,25 @@ class Post(WordPressModel):
 
     # cache stuff
 
+    @instrumented('Post._get_children')
     def _get_children(self):
         if self.child_cache is None:
-            self.child_cache = list(Post.objects.filter(parent_id=self.pk))
+            prefetch_children([self])
         return self.child_cache
 
-    def _get_terms(self, taxonomy):
-
-        if not self.term_cache:
-
-            self.term_cache = collections.defaultdict(list)
-
-            qs = Taxonomy.objects.filter(relationships__object_id=self.id).select_related()
-            qs = qs.order_by('relationships__order', 'term__name')
-
-            term_ids = [tax.term_id for tax in qs]
-
-            terms = {}
-            for term in Term.objects.filter(id__in=term_ids):
-                terms[term.id] = term
-
-            for tax in qs:
-                if tax.term_id in terms:
-                    self.term_cache[tax.name].append(terms[tax.term_id])
+    @instrumented('Post._get_attachments')
+    def _get_attachments(self):
+        if self.attachment_cache is None:
+            if self.child_cache is None:
+                prefetch_attachments([self])
+            else:
+                self.attachment_cache = [post for post in self.child_cache if post.post_type == 'attachment']
+        return self.attachment_cache
 
+    @instrumented('Post._get_terms')
+    def _get_terms(self, taxonomy):
+        if self.term_cache is None:
+            prefetch_terms([self])
         return self.term_cache.get(taxonomy)
 
     # properties
@@ -365,6 +787,25 @@ class Post(WordPressModel):
     def children(self):
         return self._get_children()
 
+    @property
+    def summary(self):
+        """
+        The excerpt of the post or, if it has none, the first words of its
+        content with tags removed, as WordPress does.
+        """
+        if self.excerpt:
+            return self.excerpt
+        content = getattr(self, 'content_preview', None)
+        if content is None:
+            content = self.content
+        return Truncator(strip_tags(content)).words(EXCERPT_LENGTH, truncate=u' [\u2026]')
+
+    @property
+    def meta_dict(self):
+        if self.meta_cache is None:
+            self.meta_cache = PostMetaDict(self)
+        return self.meta_cache
+
     @property
     def parent(self):
         if self.parent_id:
@@ -382,23 +823,72 @@ class Post(WordPressModel):
         return self._get_terms("category")
 
     def attachments(self):
-        for post in self._get_children():
-            if post.post_type == 'attachment':
-                yield {
-                    'id': post.id,
-                    'slug': post.slug,
-                    'timestamp': post.post_date,
-                    'description': post.content,
-                    'title': post.title,
-                    'guid': post.guid,
-                    'mimetype': post.mime_type,
-                }
+        for post in self._get_attachments():
+            yield {
+                'id': post.id,
+                'slug': post.slug,
+                'timestamp': post.post_date,
+                'description': post.content,
+                'title': post.title,
+                'guid': post.guid,
+                'mimetype': post.mime_type,
+            }
 
     def tags(self):
         return self._get_terms("post_tag")
 
 
-class PostMeta(WordPressModel):
+class PostMetaDict(Mapping):
+    """
+    Read-only mapping of meta keys to values for a post.
+
+    Values are loaded lazily: a missing key is looked up on its own and
+    iterating over the mapping loads all remaining meta for the post. As
+    with WordPress, each key maps to the first value stored for it; use
+    getlist() to get all of them.
+    """
+
+    def __init__(self, post):
+        self.post = post
+        self.complete = False
+        self._values = {}
+
+    def update(self, values, keys=None):
+        for key in (keys if keys is not None else values.keys()):
+            self._values[key] = values.get(key, [])
+        if keys is None:
+            self.complete = True
+
+    def _load(self, key=None):
+        qs = PostMeta.objects.filter(post=self.post.pk)
+        if key is not None:
+            qs = qs.filter(key=key)
+        values = collections.defaultdict(list)
+        for (k, value) in qs.order_by('id').values_list('key', 'value'):
+            values[k].append(value)
+        self.update(values, None if key is None else [key])
+
+    def getlist(self, key):
+        if key not in self._values and not self.complete:
+            self._load(key)
+        return self._values.get(key, [])
+
+    def __getitem__(self, key):
+        values = self.getlist(key)
+        if not values:
+            raise KeyError(key)
+        return values[0]
+
+    def __iter__(self):
+        if not self.complete:
+            self._load()
+        return (key for (key, values) in self._values.items() if values)
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+class PostMeta(SerializedValueMixin, WordPressModel):
     """
     Post meta data.
     """
@@ -416,11 +906,89 @@ class PostMeta(WordPressModel):
         return u"%s: %s" % (self.key, self.value)
 
 
+class CommentManager(WordPressManager):
+    """
+    Provides methods for loading threaded comments.
+    """
+
+    def approved(self):
+        return self.filter(approved='1')
+
+    @instrumented('CommentManager.threads')
+    def threads(self, posts):
+        """
+        Load the approved comments of a list of posts in a single query and
+        assemble them into threads, oldest first.
+
+        Returns a dict of post IDs to lists of top level comments. Each
+        comment has a list of its replies as children and its nesting level
+        as depth, starting at 0.
+        """
+
+        post_ids = [getattr(post, 'pk', post) for post in posts]
+        comments = list(self.approved().filter(post__in=post_ids).order_by('post_date', 'id'))
+
+        by_id = dict((comment.pk, comment) for comment in comments)
+        threads = dict((post_id, []) for post_id in post_ids)
+
+        for comment in comments:
+            comment.children = []
+            comment.depth = 0
+
+        for comment in comments:
+            parent = by_id.get(comment.parent_id)
+            if parent is not None and parent.post_id == comment.post_id:
+                comment.parent_cache = parent
+                parent.children.append(comment)
+            else:
+                threads[comment.post_id].append(comment)
+
+        for roots in threads.values():
+            stack = list(roots)
+            while stack:
+                comment = stack.pop()
+                for child in comment.children:
+                    child.depth = comment.depth + 1
+                    stack.append(child)
+
+        return threads
+
+    @instrumented('CommentManager.thread')
+    def thread(self, post, per_page=None, page=1, flat=False):
+        """
+        Load the approved comments of a post as threads in a single query.
+
+        If per_page is given, only the top level comments on that page are
+        returned along with their replies. If flat is True, the comments are
+        returned as a single list in display order so that a template can
+        render them by depth without recursion.
+        """
+
+        roots = self.threads([post])[getattr(post, 'pk', post)]
+
+        if per_page:
+            start = (int(page) - 1) * int(per_page)
+            roots = roots[start:start + int(per_page)]
+
+        if not flat:
+            return roots
+
+        comments = []
+        stack = list(reversed(roots))
+        while stack:
+            comment = stack.pop()
+            comments.append(comment)
+            stack.extend(reversed(comment.children))
+        return comments
+
+
 class Comment(WordPressModel):
     """
     Comments to Posts.
     """
 
+    objects = CommentManager()
+
     id = models.IntegerField(db_column='comment_id', primary_key=True)
     post = models.ForeignKey(Post, related_name="comments", db_column="comment_post_id")
     user_id = models.IntegerField(db_column='user_id', default=0)
@@ -435,6 +1003,7 @@ class Comment(WordPressModel):
 
     # comment data
     post_date = models.DateTimeField(db_column='comment_date_gmt')
+    post_date_local = models.DateTimeField(db_column='comment_date')
     content = models.TextField(db_column='comment_content')
     karma = models.IntegerField(default=0, db_column='comment_karma')
     approved = models.CharField(max_length=20, db_column='comment_approved')
@@ -443,6 +1012,8 @@ class Comment(WordPressModel):
     agent = models.CharField(max_length=255, db_column='comment_agent')
     comment_type = models.CharField(max_length=20)
 
+    parent_cache = None
+
     class Meta:
         db_table = '%s_comments' % TABLE_PREFIX
         ordering = ['-post_date']
@@ -455,7 +1026,9 @@ class Comment(WordPressModel):
         return "%s#comment-%i" % (self.post.get_absolute_url(), self.pk)
 
     def parent(self):
-        return self._get_object(Comment, self.parent_id)
+        if self.parent_id and self.parent_cache is None:
+            self.parent_cache = self._get_object(Comment, self.parent_id)
+        return self.parent_cache
 
     """
     def user(self):
@@ -489,8 +1062,175 @@ class Term(WordPressModel):
         return ('wp_archive_term', (self.slug, ))
 
 
+class TaxonomyTree(object):
+    """
+    In-memory hierarchy of a taxonomy, keyed on term taxonomy IDs.
+
+    Ancestors and descendants of every node are computed when the tree is
+    built so that lookups don't have to walk the tree.
+    """
+
+    def __init__(self, rows, version=None):
+
+        self.version = version
+        self.parents = {}
+        self.slugs = collections.defaultdict(list)
+        self._slugs = {}
+
+        # the parent column holds the term ID of the parent, not its term taxonomy ID
+        rows = list(rows)
+        by_term = dict((term_id, tt_id) for (tt_id, term_id, parent_id, slug) in rows)
+
+        for (tt_id, term_id, parent_id, slug) in rows:
+            self.parents[tt_id] = by_term.get(parent_id)
+            if slug is not None:
+                self.slugs[slug].append(tt_id)
+                self._slugs[tt_id] = slug
+
+        self._children = collections.defaultdict(list)
+        self._ancestors = {}
+        self._descendants = collections.defaultdict(set)
+
+        for tt_id in self.parents:
+
+            if self.parents[tt_id] is not None:
+                self._children[self.parents[tt_id]].append(tt_id)
+
+            ancestors = []
+            parent = self.parents[tt_id]
+            while parent is not None and parent != tt_id and parent not in ancestors:
+                ancestors.append(parent)
+                parent = self.parents.get(parent)
+
+            self._ancestors[tt_id] = ancestors
+            for ancestor in ancestors:
+                self._descendants[ancestor].add(tt_id)
+
+    def __contains__(self, tt_id):
+        return tt_id in self.parents
+
+    def ids_for_slug(self, slug):
+        return self.slugs.get(slug, [])
+
+    def parent(self, tt_id):
+        return self.parents.get(tt_id)
+
+    def children(self, tt_id):
+        return self._children.get(tt_id, [])
+
+    def ancestors(self, tt_id):
+        """
+        Return the IDs of the ancestors of a node, nearest first.
+        """
+        return self._ancestors.get(tt_id, [])
+
+    def descendants(self, tt_id):
+        return self._descendants.get(tt_id, set())
+
+    def path(self, tt_id):
+        """
+        Return the IDs from the root of the tree down to a node.
+        """
+        return list(reversed(self.ancestors(tt_id))) + [tt_id]
+
+    def path_slugs(self, tt_id):
+        """
+        Return the slugs from the root of the tree down to a node, as they
+        appear in a %category% permalink.
+        """
+        return [self._slugs.get(node) for node in self.path(tt_id)]
+
+
+class TaxonomyManager(WordPressManager):
+    """
+    Caches taxonomy hierarchies in process.
+    """
+
+    def __init__(self):
+        super(TaxonomyManager, self).__init__()
+        self._trees = {}
+
+    def _rows(self, name):
+        return list(self.filter(name=name).order_by('pk').values_list('id', 'term_id', 'parent_id', 'term__slug'))
+
+    def version(self, name, rows=None):
+        """
+        Return a version stamp that changes when terms are added, removed,
+        moved or renamed in a taxonomy: a hash of the ID, term, parent and
+        slug of each of them.
+        """
+        if rows is None:
+            rows = self._rows(name)
+        return hashlib.md5(repr(rows).encode('utf-8')).hexdigest()
+
+    @instrumented('TaxonomyManager.tree')
+    def tree(self, name='category'):
+        """
+        Return the TaxonomyTree for a taxonomy. Every
+        WP_TAXONOMY_CACHE_TIMEOUT seconds the taxonomy is read again with a
+        single query and the tree is rebuilt if its version has changed.
+        """
+
+        now = time.time()
+        (expires, tree) = self._trees.get(name, (0, None))
+        record_cache(tree is not None and now < expires)
+
+        if tree is None or now >= expires:
+            rows = self._rows(name)
+            version = self.version(name, rows)
+            if tree is None or tree.version != version:
+                tree = TaxonomyTree(rows, version)
+            self._trees[name] = (now + TAXONOMY_CACHE_TIMEOUT, tree)
+
+        return tree
+
+    def invalidate(self, name):
+        self._trees.pop(name, None)
+
+    @instrumented('TaxonomyManager.popular_terms')
+    def popular_terms(self, taxonomy='post_tag', limit=10, exclude=('uncategorized',), exact=False,
+                      timeout=TAXONOMY_CACHE_TIMEOUT):
+        """
+        Return the taxonomies with the most posts, with their terms loaded.
+
+        By default this reads the post counts WordPress keeps for each term.
+        If exact is True, published posts are counted with a grouped
+        aggregate query instead. Results are cached for timeout seconds.
+
+        @arg taxonomy Can either be a string or a list of taxonomy names.
+        """
+
+        taxonomies = sorted(taxonomy) if isinstance(taxonomy, (list, tuple, set)) else [taxonomy]
+        exclude = sorted(exclude or ())
+
+        key = 'wordpress:%s:popular:%s' % (TABLE_PREFIX, hashlib.md5(
+            repr((taxonomies, int(limit), exclude, bool(exact))).encode('utf-8')).hexdigest())
+
+        terms = cache.get(key)
+        record_cache(terms is not None)
+
+        if terms is None:
+
+            qs = self.filter(name__in=taxonomies).exclude(term__slug__in=exclude).select_related('term')
+
+            if exact:
+                qs = qs.filter(relationships__object__status='publish', relationships__object__post_type='post')
+                qs = qs.annotate(num_posts=models.Count('relationships__object'))
+                terms = list(qs.order_by('-num_posts')[:limit])
+                for tax in terms:
+                    tax.count = tax.num_posts
+            else:
+                terms = list(qs.filter(count__gt=0).order_by('-count')[:limit])
+
+            cache.set(key, terms, timeout)
+
+        return terms
+
+
 class Taxonomy(WordPressModel):
 
+    objects = TaxonomyManager()
+
     id = models.IntegerField(db_column='term_taxonomy_id', primary_key=True)
     term = models.ForeignKey(Term, related_name='taxonomies', blank=True, null=True)
     #term_id = models.IntegerField()
@@ -512,7 +1252,20 @@ class Taxonomy(WordPressModel):
         return u"%s: %s" % (self.name, term)
 
     def parent(self):
-        return self._get_object(Taxonomy, self.parent_id)
+        parent_id = Taxonomy.objects.tree(self.name).parent(self.pk)
+        if parent_id is not None:
+            return self._get_object(Taxonomy, parent_id)
+
+    def ancestors(self):
+        """
+        Return the ancestors of this taxonomy, starting at the root.
+        """
+        ids = Taxonomy.objects.tree(self.name).ancestors(self.pk)
+        taxonomies = Taxonomy.objects.select_related('term').in_bulk(ids) if ids else {}
+        return [taxonomies[tt_id] for tt_id in reversed(ids) if tt_id in taxonomies]
+
+    def descendants(self):
+        return Taxonomy.objects.filter(pk__in=Taxonomy.objects.tree(self.name).descendants(self.pk))
 
     #def term(self):
     #    return self._get_object(Term, self.term_id)
@@ -0,0 +1,151 @@
+"""
+Keyset pagination for post querysets.
+
+Instead of LIMIT/OFFSET, each page is fetched by seeking past the
+(post_date, ID) of the last post on the previous page, so deep pages cost
+the same as the first one. Pages are identified by opaque cursor tokens.
+"""
+
+import base64
+import datetime
+import hashlib
+
+try:
+    from django.core.exceptions import EmptyResultSet
+except ImportError:
+    from django.db.models.sql.datastructures import EmptyResultSet
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+COUNT_CACHE_TIMEOUT = getattr(settings, 'WP_COUNT_CACHE_TIMEOUT', 300)
+
+DATE_FORMAT = '%Y%m%d%H%M%S'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def cached_count(qs, timeout=COUNT_CACHE_TIMEOUT):
+    """
+    Count the rows in a queryset, caching the result by its SQL.
+    """
+
+    try:
+        sql = str(qs.query).encode('utf-8')
+    except EmptyResultSet:
+        return 0
+
+    key = 'wordpress:count:%s:%s' % (qs.db, hashlib.md5(sql).hexdigest())
+    count = cache.get(key)
+
+    if count is None:
+        count = qs.count()
+        cache.set(key, count, timeout)
+
+    return count
+
+
+def encode_cursor(post, direction):
+    value = '%s%s.%i' % (direction, post.post_date.strftime(DATE_FORMAT), post.pk)
+    return base64.urlsafe_b64encode(value.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Return a tuple of direction, post date and ID for a cursor token.
+    """
+    try:
+        value = base64.urlsafe_b64decode(str(token) + '=' * (-len(token) % 4)).decode('ascii')
+        (date, pk) = value[1:].split('.')
+        direction = value[0]
+        if direction not in ('n', 'p'):
+            raise ValueError(direction)
+        return (direction, datetime.datetime.strptime(date, DATE_FORMAT), int(pk))
+    except (TypeError, ValueError):
+        raise InvalidCursor(token)
+
+
+class KeysetPage(object):
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<KeysetPage of %i>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return encode_cursor(self.object_list[-1], 'n')
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return encode_cursor(self.object_list[0], 'p')
+
+
+class KeysetPaginator(object):
+    """
+    Paginates a post queryset newest first, keyed on (post_date, ID).
+
+    The total count is only run if it is used and is cached for
+    WP_COUNT_CACHE_TIMEOUT seconds.
+    """
+
+    def __init__(self, object_list, per_page, **kwargs):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+
+    @property
+    def count(self):
+        return cached_count(self.object_list)
+
+    @property
+    def num_pages(self):
+        return max(1, (self.count + self.per_page - 1) // self.per_page)
+
+    def page(self, cursor=None):
+        """
+        Return the page for a cursor token, or the first page if it is None.
+        """
+
+        qs = self.object_list
+
+        if not cursor:
+            posts = list(qs.order_by('-post_date', '-pk')[:self.per_page + 1])
+            return KeysetPage(posts[:self.per_page], self, len(posts) > self.per_page, False)
+
+        (direction, post_date, pk) = decode_cursor(cursor)
+
+        if direction == 'n':
+            qs = qs.filter(Q(post_date__lt=post_date) | Q(post_date=post_date, pk__lt=pk))
+            posts = list(qs.order_by('-post_date', '-pk')[:self.per_page + 1])
+            return KeysetPage(posts[:self.per_page], self, len(posts) > self.per_page, True)
+
+        qs = qs.filter(Q(post_date__gt=post_date) | Q(post_date=post_date, pk__gt=pk))
+        posts = list(qs.order_by('post_date', 'pk')[:self.per_page + 1])
+        return KeysetPage(list(reversed(posts[:self.per_page])), self, True, len(posts) > self.per_page)
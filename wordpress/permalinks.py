@@ -0,0 +1,419 @@
+"""
+Resolving permalinks to posts through a cache-backed index.
+
+Each published post is indexed in the Django cache under the values that
+identify it in a permalink structure, such as its date and slug for
+/%year%/%monthnum%/%day%/%postname%/, so resolving a path is a single cache
+lookup. The index is built by the wppermalinks management command and kept
+current by polling for posts modified since the last refresh. Paths that
+aren't in the index fall back to a query on the post slug, which also adds
+them to the index.
+"""
+
+import hashlib
+import re
+import threading
+import time
+
+try:
+    from urllib.parse import quote, unquote
+except ImportError:
+    from urllib import quote, unquote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from wordpress.instrumentation import instrumented, record_cache
+from wordpress.models import Option, Post, Taxonomy, TABLE_PREFIX
+
+PERMALINK_STRUCTURE = getattr(settings, 'WP_PERMALINK_STRUCTURE', None)
+PERMALINK_CACHE_TIMEOUT = getattr(settings, 'WP_PERMALINK_CACHE_TIMEOUT', None)
+PERMALINK_REFRESH_INTERVAL = getattr(settings, 'WP_PERMALINK_REFRESH_INTERVAL', 60)
+
+# the structure of the URLs in wordpress.urls
+DATE_STRUCTURE = '/%year%/%monthnum%/%day%/%postname%/'
+
+TAG_PATTERNS = {
+    'year': r'\d{4}',
+    'monthnum': r'\d{1,2}',
+    'day': r'\d{1,2}',
+    'hour': r'\d{1,2}',
+    'minute': r'\d{1,2}',
+    'second': r'\d{1,2}',
+    'postname': r'[^/]+',
+    'post_id': r'\d+',
+    'category': r'.+?',
+    'author': r'[^/]+',
+}
+
+# tags that identify a post; category and author are checked against the
+# post once it is found and the others are matched but not checked
+DATE_TAGS = ('year', 'monthnum', 'day', 'hour', 'minute', 'second')
+KEY_TAGS = DATE_TAGS + ('postname', 'post_id')
+CHECKED_TAGS = ('category', 'author')
+
+
+def normalize_slug(slug):
+    """
+    Return a slug percent-encoded and lowercased the way WordPress stores it.
+    """
+    if not isinstance(slug, str):
+        slug = slug.encode('utf-8')
+    return quote(unquote(slug)).lower()
+
+
+class PermalinkStructure(object):
+    """
+    A WordPress permalink structure such as /%year%/%postname%/.
+    """
+
+    def __init__(self, structure):
+
+        self.structure = structure.strip('/')
+
+        pattern = []
+        for (i, part) in enumerate(re.split(r'%(\w+)%', self.structure)):
+            if i % 2 == 0:
+                pattern.append(re.escape(part))
+            elif part in TAG_PATTERNS:
+                pattern.append('(?P<%s>%s)' % (part, TAG_PATTERNS[part]))
+            else:
+                pattern.append(r'[^/]+')
+
+        self.regex = re.compile('^%s$' % ''.join(pattern))
+        self.tags = tuple(tag for tag in KEY_TAGS if tag in self.regex.groupindex)
+        self.checked_tags = tuple(tag for tag in CHECKED_TAGS if tag in self.regex.groupindex)
+
+    def __repr__(self):
+        return '<PermalinkStructure /%s/>' % self.structure
+
+    def key_for_path(self, path):
+        """
+        Return the identifying values of a path as a tuple or None if the
+        path doesn't match the structure.
+        """
+        m = self.regex.match(path.strip('/'))
+        if m is None:
+            return None
+        return tuple(normalize_slug(m.group(tag)) if tag == 'postname' else int(m.group(tag))
+                     for tag in self.tags)
+
+    def matches(self, path, post):
+        """
+        Return whether the category and author in a path belong to a post.
+        The category may be any of the post's categories, with the slugs of
+        its parents before it.
+        """
+
+        m = self.regex.match(path.strip('/'))
+        if m is None:
+            return False
+
+        if 'category' in self.checked_tags:
+            requested = [normalize_slug(slug) for slug in m.group('category').split('/')]
+            slugs = set(term.slug for term in post.categories() or ())
+            if requested[-1] not in slugs:
+                return False
+            tree = Taxonomy.objects.tree('category')
+            if not any(tree.path_slugs(tt_id) == requested for tt_id in tree.ids_for_slug(requested[-1])):
+                return False
+
+        if 'author' in self.checked_tags:
+            if normalize_slug(m.group('author')) != normalize_slug(post.author.username):
+                return False
+
+        return True
+
+    def key_for_post(self, pk, slug, post_date):
+        values = {
+            'year': post_date.year,
+            'monthnum': post_date.month,
+            'day': post_date.day,
+            'hour': post_date.hour,
+            'minute': post_date.minute,
+            'second': post_date.second,
+            'postname': normalize_slug(slug),
+            'post_id': pk,
+        }
+        return tuple(values[tag] for tag in self.tags)
+
+    def path_for_post(self, pk, slug, post_date):
+        """
+        Return the path of a post in this structure, without reversing a URL
+        pattern. Tags other than the date, post name and post ID are left in
+        place, so only use it for structures without them.
+        """
+        values = {
+            'year': '%04i' % post_date.year,
+            'monthnum': '%02i' % post_date.month,
+            'day': '%02i' % post_date.day,
+            'hour': '%02i' % post_date.hour,
+            'minute': '%02i' % post_date.minute,
+            'second': '%02i' % post_date.second,
+            'postname': slug,
+            'post_id': '%i' % pk,
+        }
+        return '%s/' % re.sub(r'%(\w+)%', lambda m: values.get(m.group(1), m.group(0)), self.structure)
+
+
+class PermalinkIndex(object):
+    """
+    Maps permalink paths to post IDs and attachment slugs to attachment URLs.
+
+    Paths are indexed for DATE_STRUCTURE, which wordpress.urls uses, and for
+    the site's permalink structure, read from the WP_PERMALINK_STRUCTURE
+    setting or else the permalink_structure option.
+    """
+
+    def __init__(self, refresh_interval=PERMALINK_REFRESH_INTERVAL, timeout=PERMALINK_CACHE_TIMEOUT):
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self._structures = {}
+        self._refreshed = 0
+        self._lock = threading.Lock()
+
+    def _cache_key(self, *parts):
+        digest = hashlib.md5('|'.join('%s' % part for part in parts).encode('utf-8'))
+        return 'wordpress:%s:permalink:%s' % (TABLE_PREFIX, digest.hexdigest())
+
+    def _post_key(self, structure, key):
+        return self._cache_key(structure.structure, *key)
+
+    def _attachment_key(self, parent_id, slug):
+        return self._cache_key('attachment', parent_id, normalize_slug(slug))
+
+    def _watermark_key(self):
+        return 'wordpress:%s:permalink:watermark' % TABLE_PREFIX
+
+    def _queryset(self):
+        qs = Post.objects.filter(post_type__in=('post', 'attachment')).order_by('modified', 'pk')
+        return qs.values_list('id', 'post_type', 'status', 'slug', 'post_date', 'parent_id', 'guid', 'modified')
+
+    def structures(self):
+        """
+        Return the PermalinkStructures that paths are indexed for.
+        """
+
+        structures = [DATE_STRUCTURE]
+        site = PERMALINK_STRUCTURE or Option.objects.get_value('permalink_structure')
+        if site and site.strip('/') != DATE_STRUCTURE.strip('/'):
+            structures.append(site)
+
+        parsed = []
+        for structure in structures:
+            if structure not in self._structures:
+                self._structures[structure] = PermalinkStructure(structure)
+            parsed.append(self._structures[structure])
+        return parsed
+
+    def index(self, posts):
+        """
+        Add or remove index entries for (id, post_type, status, slug,
+        post_date, parent_id, guid) rows, depending on their status.
+        """
+
+        structures = self.structures()
+        entries = {}
+        stale = []
+
+        for (pk, post_type, status, slug, post_date, parent_id, guid) in posts:
+            if post_type == 'attachment':
+                key = self._attachment_key(parent_id, slug)
+                if status == 'inherit':
+                    entries[key] = guid
+                else:
+                    stale.append(key)
+            else:
+                for structure in structures:
+                    key = self._post_key(structure, structure.key_for_post(pk, slug, post_date))
+                    if status == 'publish':
+                        entries[key] = pk
+                    else:
+                        stale.append(key)
+
+        if entries:
+            cache.set_many(entries, self.timeout)
+        if stale:
+            cache.delete_many(stale)
+
+    def _index_chunks(self, qs, chunk_qs, expires, chunk_size, max_chunks=None):
+        """
+        Index the rows of chunk_qs and the following rows of qs in keyset
+        chunks ordered by (post_modified, ID), saving the position reached
+        after each chunk. Returns the number of rows read.
+        """
+
+        count = 0
+        chunks = 0
+
+        while max_chunks is None or chunks < max_chunks:
+
+            chunk = list(chunk_qs[:chunk_size])
+            if not chunk:
+                break
+
+            self.index(row[:7] for row in chunk)
+            count += len(chunk)
+            chunks += 1
+
+            (last_pk, last_modified) = (chunk[-1][0], chunk[-1][7])
+            self._save_watermark((last_modified, last_pk, expires))
+            chunk_qs = qs.filter(Q(modified__gt=last_modified) | Q(modified=last_modified, pk__gt=last_pk))
+
+        return count
+
+    def _save_watermark(self, watermark):
+        # the watermark expires with the entries written by the rebuild, so
+        # an index that has partly expired is never refreshed as if whole
+        expires = watermark[2]
+        if expires is None:
+            cache.set(self._watermark_key(), watermark, None)
+        elif expires > time.time():
+            cache.set(self._watermark_key(), watermark, int(expires - time.time()) or 1)
+        else:
+            cache.delete(self._watermark_key())
+
+    @instrumented('PermalinkIndex.refresh')
+    def refresh(self, chunk_size=1000, max_chunks=None):
+        """
+        Index the posts and attachments modified since the last refresh and
+        return the number of rows read.
+
+        Only the rows after the position saved by the last rebuild or
+        refresh are read, at most max_chunks chunks of them. If there is no
+        saved position, because the index was never built or its entries
+        have expired, nothing is read until rebuild() runs again.
+        """
+
+        self._refreshed = time.time()
+
+        watermark = cache.get(self._watermark_key())
+        if watermark is None:
+            return 0
+
+        qs = self._queryset()
+        return self._index_chunks(qs, qs.filter(modified__gte=watermark[0]), watermark[2],
+                                  chunk_size, max_chunks)
+
+    @instrumented('PermalinkIndex.rebuild')
+    def rebuild(self, chunk_size=1000):
+        """
+        Index every post and attachment and return the number of rows read.
+        This reads the whole posts table, so it is run by the wppermalinks
+        management command rather than during requests.
+        """
+
+        self._refreshed = time.time()
+
+        cache.delete(self._watermark_key())
+        expires = None if self.timeout is None else time.time() + self.timeout
+
+        qs = self._queryset()
+        return self._index_chunks(qs, qs, expires, chunk_size)
+
+    def maybe_refresh(self):
+        """
+        Refresh the index with one chunk of rows if it hasn't been refreshed
+        by this process in the last refresh_interval seconds.
+        """
+        if time.time() - self._refreshed < self.refresh_interval:
+            return
+        if self._lock.acquire(False):
+            try:
+                self.refresh(max_chunks=1)
+            finally:
+                self._lock.release()
+
+    @instrumented('PermalinkIndex.resolve')
+    def resolve(self, path):
+        """
+        Return the ID of the published post at a path if the index has it,
+        otherwise None. The ID isn't checked against the database, so paths
+        in structures with a category or author aren't resolved.
+        """
+
+        self.maybe_refresh()
+
+        for structure in self.structures():
+            key = structure.key_for_path(path)
+            if key is None or structure.checked_tags:
+                continue
+            if structure.tags == ('post_id',):
+                return key[0]
+            pk = cache.get(self._post_key(structure, key))
+            record_cache(pk is not None)
+            if pk is not None:
+                return pk
+
+    @instrumented('PermalinkIndex.get_post')
+    def get_post(self, path, queryset=None):
+        """
+        Return the published post at a path or None.
+
+        A post found through the index is fetched by ID and checked against
+        the path, including its category and author, so stale entries are
+        never returned. On a miss the post is looked up by slug and added to
+        the index.
+        """
+
+        if queryset is None:
+            queryset = Post.objects.published()
+
+        self.maybe_refresh()
+
+        for structure in self.structures():
+
+            key = structure.key_for_path(path)
+            if key is None:
+                continue
+
+            if structure.tags == ('post_id',):
+                pk = key[0]
+            else:
+                pk = cache.get(self._post_key(structure, key))
+                record_cache(pk is not None)
+
+            found = None
+
+            if pk is not None:
+                for post in queryset.filter(pk=pk):
+                    if structure.key_for_post(post.pk, post.slug, post.post_date) == key:
+                        found = post
+
+            if found is None:
+
+                if 'postname' in structure.tags:
+                    candidates = queryset.filter(slug=key[structure.tags.index('postname')])
+                elif 'post_id' in structure.tags:
+                    candidates = queryset.filter(pk=key[structure.tags.index('post_id')])
+                else:
+                    continue
+
+                for post in candidates:
+                    if structure.key_for_post(post.pk, post.slug, post.post_date) == key:
+                        cache.set(self._post_key(structure, key), post.pk, self.timeout)
+                        found = post
+                        break
+
+            if found is not None and structure.matches(path, found):
+                return found
+
+    def get_attachment_url(self, parent_id, slug):
+        """
+        Return the URL of the attachment of a post with a slug or None.
+        """
+
+        key = self._attachment_key(parent_id, slug)
+        url = cache.get(key)
+        record_cache(url is not None)
+
+        if url is None:
+            qs = Post.objects.filter(post_type='attachment', status='inherit', parent_id=parent_id,
+                                     slug=normalize_slug(slug))
+            for url in qs.values_list('guid', flat=True)[:1]:
+                cache.set(key, url, self.timeout)
+
+        return url
+
+
+permalinks = PermalinkIndex()
@@ -1,19 +1,238 @@
 # -*- coding: utf-8 -*-
 
+import itertools
+import random
+import threading
+import time
+
 from django.conf import settings
+from django.db import connections
 
 DATABASE = getattr(settings, "WP_DATABASE", "default")
+READ_DATABASES = getattr(settings, "WP_READ_DATABASES", ())
+READ_PIN_SECONDS = getattr(settings, "WP_READ_PIN_SECONDS", 5)
+REPLICA_CHECK_INTERVAL = getattr(settings, "WP_REPLICA_CHECK_INTERVAL", 30)
+
+_local = threading.local()
+
+# guards the replicas_read sets, which pool threads share with the request
+# that handed them work
+_replicas_lock = threading.Lock()
+
+
+def pin_to_primary():
+    """
+    Send reads to WP_DATABASE for the rest of the current request or,
+    outside of requests, from the current thread for the next
+    WP_READ_PIN_SECONDS seconds. ReplicaPinningMiddleware carries the pin
+    over to the client's next requests.
+    """
+    if getattr(_local, 'in_request', False):
+        _local.request_wrote = True
+    else:
+        _local.last_write = time.time()
+
+
+def is_pinned():
+    # a worker thread serves many clients, so during requests only the
+    # request's own writes and the pin it came in with count
+    if getattr(_local, 'in_request', False):
+        return getattr(_local, 'request_wrote', False) or getattr(_local, 'request_pinned', False)
+    return time.time() - getattr(_local, 'last_write', 0) < READ_PIN_SECONDS
+
+
+def start_request(pinned=False):
+    """
+    Start routing a request, with its reads pinned to WP_DATABASE from the
+    start if pinned is True, such as when the same client wrote recently.
+    """
+    _local.in_request = True
+    _local.request_wrote = False
+    _local.request_pinned = pinned
+    _local.replicas_read = set()
+
+
+def end_request():
+    """
+    Stop routing a request and return whether it wrote to WP_DATABASE.
+    """
+    wrote = getattr(_local, 'request_wrote', False)
+    _local.in_request = False
+    _local.request_wrote = False
+    _local.request_pinned = False
+    return wrote
+
+
+def get_state():
+    """
+    Return the pinning state of the current thread, so that work handed to
+    another thread can be routed the same way with set_state(). The set of
+    replicas read from is shared, so replica_failed() also sees the reads
+    of that work.
+    """
+    return dict(_local.__dict__)
+
+
+def set_state(state):
+    _local.__dict__.clear()
+    _local.__dict__.update(state)
+
+
+class ReplicaPool(object):
+    """
+    Picks read replicas round-robin from a list of aliases or at random by
+    weight from a dict of aliases to weights, skipping replicas that fail a
+    connection check.
+    """
+
+    def __init__(self, replicas, check_interval=REPLICA_CHECK_INTERVAL):
+        if isinstance(replicas, dict):
+            self.aliases = sorted(replicas)
+            self.weights = [replicas[alias] for alias in self.aliases]
+        else:
+            self.aliases = list(replicas)
+            self.weights = None
+        self.check_interval = check_interval
+        self._cycle = itertools.cycle(self.aliases)
+        self._lock = threading.Lock()
+        self._down = {}
+        self._checked = {}
+
+    def mark_failed(self, alias):
+        """
+        Skip a replica until it next passes a connection check, and close
+        the current thread's connection to it so the check reconnects.
+        """
+        self._down[alias] = time.time() + self.check_interval
+        try:
+            connections[alias].close()
+        except Exception:
+            pass
+
+    def check(self, alias):
+        """
+        Run a query on a replica, marking it failed if it doesn't answer.
+        Returns True if it does.
+        """
+
+        self._checked[alias] = time.time()
+
+        try:
+            cursor = connections[alias].cursor()
+            try:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            finally:
+                cursor.close()
+        except Exception:
+            self.mark_failed(alias)
+            return False
+
+        self._down.pop(alias, None)
+        return True
+
+    def is_healthy(self, alias):
+
+        now = time.time()
+
+        if self._down.get(alias, 0) > now:
+            return False
+
+        if now - self._checked.get(alias, 0) >= self.check_interval:
+            return self.check(alias)
+
+        return True
+
+    def _candidates(self):
+        if self.weights is None:
+            with self._lock:
+                start = next(self._cycle)
+            index = self.aliases.index(start)
+            return self.aliases[index:] + self.aliases[:index]
+        aliases = list(self.aliases)
+        weights = list(self.weights)
+        ordered = []
+        while aliases:
+            point = random.uniform(0, sum(weights))
+            for (i, weight) in enumerate(weights):
+                point -= weight
+                if point <= 0 or i == len(weights) - 1:
+                    ordered.append(aliases.pop(i))
+                    weights.pop(i)
+                    break
+        return ordered
+
+    def choose(self):
+        """
+        Return a healthy replica alias or None if there are none.
+        """
+        for alias in self._candidates():
+            if self.is_healthy(alias):
+                return alias
+
+
+_pool = None
+
+
+def get_replica_pool():
+    """
+    Return the ReplicaPool of WP_READ_DATABASES, shared by all routers and
+    threads, or None if the setting is empty.
+    """
+    global _pool
+    if _pool is None and READ_DATABASES:
+        _pool = ReplicaPool(READ_DATABASES)
+    return _pool
+
+
+def replica_failed():
+    """
+    Check the replicas that the current thread has read from and skip the
+    ones that don't answer. ReplicaPinningMiddleware calls this when a
+    request raises a database error; call it when catching one elsewhere.
+    """
+    pool = get_replica_pool()
+    if pool is None:
+        return
+    with _replicas_lock:
+        aliases = list(getattr(_local, 'replicas_read', ()))
+        _local.replicas_read = set()
+    for alias in aliases:
+        pool.check(alias)
 
 
 class WordpressRouter(object):
     """
     Overrides default wordpress database to WP_DATABASE setting.
+
+    If WP_READ_DATABASES is set, reads are spread over those replicas except
+    for shortly after a write, when they are pinned to WP_DATABASE so that
+    replica lag can't hide the write.
     """
 
+    def __init__(self):
+        self.replicas = get_replica_pool()
+
     def db_for_read(self, model, **hints):
         if model._meta.app_label == 'wordpress':
+            if self.replicas is not None and not is_pinned():
+                alias = self.replicas.choose()
+                if alias is not None:
+                    with _replicas_lock:
+                        if not hasattr(_local, 'replicas_read'):
+                            _local.replicas_read = set()
+                        _local.replicas_read.add(alias)
+                    return alias
             return DATABASE
         return None
 
     def db_for_write(self, model, **hints):
-        return self.db_for_read(model, **hints)
+        if model._meta.app_label == 'wordpress':
+            pin_to_primary()
+            return DATABASE
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._meta.app_label == 'wordpress' and obj2._meta.app_label == 'wordpress':
+            return True
+        return None
@@ -0,0 +1,266 @@
+"""
+Full-text search over published posts.
+
+Posts are indexed in an SQLite FTS5 database kept next to the application,
+at the path in the WP_SEARCH_INDEX setting, so searches never touch the
+WordPress database except to load the posts on the page being shown. The
+title, excerpt, content and term names of each post are indexed and
+results are ranked with BM25.
+
+Build the index with the wpsearchindex management command. After that it
+is brought up to date with the posts modified since the last update at most
+every WP_SEARCH_REFRESH_INTERVAL seconds when searching, or on each run of
+wpsearchindex. Term changes and deleted posts don't change the modification
+date of a post and are picked up by wpsearchindex --rebuild.
+"""
+
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.html import strip_tags
+from wordpress.instrumentation import instrumented
+from wordpress.models import Post, prefetch_terms
+
+SEARCH_INDEX = getattr(settings, 'WP_SEARCH_INDEX', None)
+SEARCH_REFRESH_INTERVAL = getattr(settings, 'WP_SEARCH_REFRESH_INTERVAL', 60)
+
+# BM25 weights of the title, excerpt, content and terms columns
+WEIGHTS = (10.0, 2.0, 1.0, 5.0)
+
+logger = logging.getLogger('wordpress.search')
+
+
+def match_expression(query):
+    """
+    Turn a user's query into an FTS5 expression matching all of its words.
+    Returns None if the query has no words.
+    """
+    words = re.findall(r'\w+', query, re.UNICODE)
+    if not words:
+        return None
+    return ' '.join('"%s"' % word for word in words)
+
+
+class SearchIndex(object):
+
+    def __init__(self, path, refresh_interval=SEARCH_REFRESH_INTERVAL):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._local = threading.local()
+        self._refreshed = 0
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """
+        Return the SQLite connection of the current thread, creating the
+        index tables if needed.
+        """
+
+        conn = getattr(self._local, 'connection', None)
+
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS posts USING fts5("
+                         "title, excerpt, content, terms, tokenize='porter unicode61')")
+            conn.execute('CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value TEXT)')
+            conn.commit()
+            self._local.connection = conn
+
+        return conn
+
+    def _get_state(self, name):
+        row = self.connection().execute('SELECT value FROM state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, name, value):
+        self.connection().execute('INSERT OR REPLACE INTO state (name, value) VALUES (?, ?)', (name, value))
+
+    def is_ready(self):
+        """
+        Return True once the index has been built.
+        """
+        return self._get_state('watermark') is not None
+
+    def index(self, posts):
+        """
+        Add published posts to the index and remove the others.
+        """
+
+        prefetch_terms(posts)
+        conn = self.connection()
+
+        for post in posts:
+            conn.execute('DELETE FROM posts WHERE rowid = ?', (post.pk,))
+            if post.status == 'publish':
+                terms = ' '.join(term.name for terms in post.term_cache.values() for term in terms)
+                conn.execute('INSERT INTO posts (rowid, title, excerpt, content, terms) VALUES (?, ?, ?, ?, ?)',
+                             (post.pk, post.title, strip_tags(post.excerpt), strip_tags(post.content), terms))
+
+    @instrumented('SearchIndex.refresh')
+    def refresh(self, chunk_size=500, max_chunks=None):
+        """
+        Index the posts modified since the last refresh.
+
+        Posts are read in keyset chunks ordered by (post_modified, ID) and
+        the position reached is stored in the index after each chunk, so an
+        interrupted refresh, or one stopped after max_chunks chunks, picks
+        up where it stopped. Returns the number of posts read.
+        """
+
+        self._refreshed = time.time()
+        conn = self.connection()
+
+        qs = Post.objects.filter(post_type='post').order_by('modified', 'pk')
+        qs = qs.only('id', 'status', 'title', 'excerpt', 'content', 'modified')
+
+        watermark = self._get_state('watermark')
+        if watermark:
+            (modified, pk) = watermark.split('|')
+            chunk_qs = qs.filter(Q(modified__gt=modified) | Q(modified=modified, pk__gt=int(pk)))
+        else:
+            chunk_qs = qs
+
+        count = 0
+        chunks = 0
+
+        while max_chunks is None or chunks < max_chunks:
+
+            chunk = list(chunk_qs[:chunk_size])
+            if not chunk:
+                break
+
+            last = chunk[-1]
+            self.index(chunk)
+            self._set_state('watermark', '%s|%i' % (last.modified.strftime('%Y-%m-%d %H:%M:%S'), last.pk))
+            conn.commit()
+            count += len(chunk)
+            chunks += 1
+
+            chunk_qs = qs.filter(Q(modified__gt=last.modified) | Q(modified=last.modified, pk__gt=last.pk))
+
+        if watermark is None and count == 0:
+            self._set_state('watermark', '')
+            conn.commit()
+
+        return count
+
+    def rebuild(self, chunk_size=500):
+        """
+        Empty the index and index every post.
+        """
+        conn = self.connection()
+        conn.execute('DELETE FROM posts')
+        conn.execute('DELETE FROM state')
+        conn.commit()
+        return self.refresh(chunk_size)
+
+    def maybe_refresh(self):
+        """
+        Refresh a built index with one chunk of posts if this process
+        hasn't refreshed it in the last refresh_interval seconds. Larger
+        backlogs are caught up over several searches or by wpsearchindex.
+        """
+        if time.time() - self._refreshed < self.refresh_interval or not self.is_ready():
+            return
+        if self._lock.acquire(False):
+            try:
+                self.refresh(max_chunks=1)
+            except sqlite3.OperationalError:
+                # another process is writing to the index
+                logger.warning('search index is locked, skipping refresh', exc_info=True)
+                self.connection().rollback()
+            finally:
+                self._lock.release()
+
+    @instrumented('SearchIndex.search')
+    def search(self, query, limit=10, offset=0):
+        """
+        Return a list of (post ID, score) tuples for the posts matching all
+        words of query, best match first.
+        """
+        expression = match_expression(query)
+        if expression is None:
+            return []
+        self.maybe_refresh()
+        return self.connection().execute(
+            'SELECT rowid, bm25(posts, %s, %s, %s, %s) AS score FROM posts WHERE posts MATCH ? '
+            'ORDER BY score LIMIT ? OFFSET ?' % WEIGHTS, (expression, limit, offset)).fetchall()
+
+    @instrumented('SearchIndex.count')
+    def count(self, query):
+        expression = match_expression(query)
+        if expression is None:
+            return 0
+        return self.connection().execute('SELECT COUNT(*) FROM posts WHERE posts MATCH ?', (expression,)).fetchone()[0]
+
+
+class SearchResults(object):
+    """
+    The posts matching a search, best match first.
+
+    Supports len() and slicing, as Django's Paginator needs. Each slice runs
+    one index query and loads the posts in it by ID with their terms.
+    """
+
+    def __init__(self, index, query, queryset=None):
+        self.index = index
+        self.query = query
+        self.queryset = Post.objects.published() if queryset is None else queryset
+        self._count = None
+
+    def __repr__(self):
+        return '<SearchResults for %r>' % self.query
+
+    def count(self):
+        if self._count is None:
+            self._count = self.index.count(self.query)
+        return self._count
+
+    __len__ = count
+
+    def __iter__(self):
+        return iter(self[:self.count()])
+
+    def __getitem__(self, index):
+
+        if not isinstance(index, slice):
+            posts = self[index:index + 1]
+            if not posts:
+                raise IndexError(index)
+            return posts[0]
+
+        start = index.start or 0
+        stop = self.count() if index.stop is None else index.stop
+        if stop <= start:
+            return []
+
+        rows = self.index.search(self.query, stop - start, start)
+        qs = self.queryset.filter(pk__in=[pk for (pk, score) in rows]).with_terms()
+        posts = dict((post.pk, post) for post in qs)
+        scores = dict(rows)
+
+        results = []
+        for (pk, score) in rows:
+            if pk in posts:
+                posts[pk].search_score = -scores[pk]
+                results.append(posts[pk])
+        return results
+
+
+_index = None
+
+
+def get_index():
+    """
+    Return the SearchIndex at WP_SEARCH_INDEX or None if it isn't set.
+    """
+    global _index
+    if _index is None and SEARCH_INDEX:
+        _index = SearchIndex(SEARCH_INDEX)
+    return _index
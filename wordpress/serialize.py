@@ -0,0 +1,227 @@
+"""
+Reading and writing of PHP serialize() formatted values.
+
+WordPress stores arrays and objects in options and meta tables using PHP's
+serialize() format. The parser is a single pass over the encoded bytes that
+keeps nested arrays on an explicit stack, so deeply nested or very large
+values (widget settings and theme mods are often 100KB+) are decoded
+without recursion or regular expressions.
+"""
+
+import collections
+
+__all__ = ('PHPObject', 'dumps', 'is_serialized', 'loads', 'maybe_loads')
+
+_PENDING = object()
+_NO_KEY = object()
+
+
+class PHPObject(collections.OrderedDict):
+    """
+    A decoded PHP object. Properties are stored as dict items.
+    """
+
+    def __init__(self, name, *args, **kwargs):
+        super(PHPObject, self).__init__(*args, **kwargs)
+        self.name = name
+
+    def __repr__(self):
+        return 'PHPObject(%r, %r)' % (self.name, list(self.items()))
+
+
+def _expect(data, pos, token):
+    if data[pos:pos + len(token)] != token:
+        raise ValueError("expected %r at offset %i" % (token, pos))
+    return pos + len(token)
+
+
+def _read_until(data, pos, token):
+    end = data.find(token, pos)
+    if end == -1:
+        raise ValueError("expected %r after offset %i" % (token, pos))
+    return data[pos:end], end + 1
+
+
+def _read_string(data, pos):
+    # LEN:"VALUE"
+    (length, pos) = _read_until(data, pos, b':')
+    pos = _expect(data, pos, b'"')
+    end = pos + int(length)
+    value = data[pos:end]
+    if len(value) != int(length):
+        raise ValueError("string at offset %i is shorter than its length" % pos)
+    return value, _expect(data, end, b'"')
+
+
+def loads(data, charset='utf-8', errors='strict'):
+    """
+    Decode a PHP serialized value.
+
+    Arrays are decoded as OrderedDicts and objects as PHPObjects. Strings are
+    decoded using charset unless charset is None, in which case they are
+    returned as bytes. Raises ValueError if data is not a valid value.
+    """
+
+    if not isinstance(data, bytes):
+        data = data.encode(charset or 'utf-8')
+
+    pos = 0
+    stack = []
+
+    try:
+
+        while True:
+
+            token = data[pos:pos + 1]
+
+            if token == b'N':
+                value = None
+                pos = _expect(data, pos + 1, b';')
+
+            elif token in (b'b', b'i', b'd'):
+                (raw, pos) = _read_until(data, _expect(data, pos + 1, b':'), b';')
+                if token == b'b':
+                    value = raw == b'1'
+                elif token == b'i':
+                    value = int(raw)
+                else:
+                    value = float(raw)
+
+            elif token == b's':
+                (value, pos) = _read_string(data, _expect(data, pos + 1, b':'))
+                pos = _expect(data, pos, b';')
+                if charset is not None:
+                    value = value.decode(charset, errors)
+
+            elif token in (b'a', b'O'):
+                pos = _expect(data, pos + 1, b':')
+                if token == b'O':
+                    (name, pos) = _read_string(data, pos)
+                    container = PHPObject(name.decode(charset or 'utf-8', errors))
+                    pos = _expect(data, pos, b':')
+                else:
+                    container = collections.OrderedDict()
+                (count, pos) = _read_until(data, pos, b':')
+                pos = _expect(data, pos, b'{')
+                stack.append([container, 2 * int(count), _NO_KEY])
+                value = _PENDING
+
+            else:
+                raise ValueError("unsupported type %r at offset %i" % (token, pos))
+
+            # add the value to its array, closing any arrays that are complete
+
+            while True:
+
+                if value is not _PENDING:
+                    if not stack:
+                        if data[pos:].strip():
+                            raise ValueError("extra data at offset %i" % pos)
+                        return value
+                    frame = stack[-1]
+                    if frame[2] is _NO_KEY:
+                        frame[2] = value
+                    else:
+                        frame[0][frame[2]] = value
+                        frame[2] = _NO_KEY
+                    frame[1] -= 1
+
+                frame = stack[-1]
+                if frame[1] > 0:
+                    break
+
+                pos = _expect(data, pos, b'}')
+                stack.pop()
+                value = frame[0]
+
+    except (IndexError, TypeError, UnicodeError) as e:
+        raise ValueError("invalid serialized value at offset %i: %s" % (pos, e))
+
+
+def _dump(value, charset, out):
+
+    if value is None:
+        out.append(b'N;')
+
+    elif isinstance(value, bool):
+        out.append(b'b:1;' if value else b'b:0;')
+
+    elif isinstance(value, int) or type(value).__name__ == 'long':
+        out.append(('i:%i;' % value).encode('ascii'))
+
+    elif isinstance(value, float):
+        if value != value:
+            raw = 'NAN'
+        elif value in (float('inf'), float('-inf')):
+            raw = 'INF' if value > 0 else '-INF'
+        else:
+            raw = repr(value)
+        out.append(('d:%s;' % raw).encode('ascii'))
+
+    elif isinstance(value, bytes):
+        out.append(('s:%i:"' % len(value)).encode('ascii'))
+        out.append(value)
+        out.append(b'";')
+
+    elif isinstance(value, (list, tuple, dict)):
+        items = value.items() if isinstance(value, dict) else enumerate(value)
+        if isinstance(value, PHPObject):
+            name = value.name.encode(charset)
+            out.append(('O:%i:"' % len(name)).encode('ascii'))
+            out.append(name)
+            out.append(('":%i:{' % len(value)).encode('ascii'))
+        else:
+            out.append(('a:%i:{' % len(value)).encode('ascii'))
+        for (k, v) in items:
+            _dump(k, charset, out)
+            _dump(v, charset, out)
+        out.append(b'}')
+
+    elif isinstance(value, type(u'')):
+        _dump(value.encode(charset), charset, out)
+
+    else:
+        raise TypeError("cannot serialize %r" % value)
+
+
+def dumps(value, charset='utf-8'):
+    """
+    Encode a value using PHP serialize() format.
+
+    Returns text so the result can be assigned to a model's value field.
+    """
+    out = []
+    _dump(value, charset, out)
+    return b''.join(out).decode(charset)
+
+
+def is_serialized(data):
+    """
+    Cheaply check if data looks like a PHP serialized value, as WordPress's
+    is_serialized() does.
+    """
+
+    if not data:
+        return False
+
+    data = data.strip()
+
+    if data in ('N;', b'N;'):
+        return True
+
+    if len(data) < 4 or data[1:2] not in (':', b':') or data[-1:] not in (';', '}', b';', b'}'):
+        return False
+
+    return data[:1] in ('a', 'O', 's', 'b', 'i', 'd', b'a', b'O', b's', b'b', b'i', b'd')
+
+
+def maybe_loads(data, charset='utf-8'):
+    """
+    Decode data if it is a PHP serialized value, otherwise return it as is.
+    """
+    if is_serialized(data):
+        try:
+            return loads(data, charset)
+        except ValueError:
+            pass
+    return data
@@ -0,0 +1,337 @@
+"""
+XML sitemaps of posts, category and tag archives and author archives.
+
+Sitemaps are generated ahead of time by the wpsitemaps management command
+and stored gzipped, as files in the WP_SITEMAP_ROOT directory or, if it
+isn't set, in the Django cache named by WP_SITEMAP_CACHE, which must be
+shared by all processes. Serving one is a single file read or cache lookup.
+
+Rows are read as values_list() tuples in keyset chunks ordered by ID, so
+generation runs in flat memory and never pages with OFFSET. Post URLs are
+formatted from DATE_STRUCTURE instead of reversing a URL pattern per post.
+Each sitemap holds at most WP_SITEMAP_LIMIT URLs and the sitemap index
+lists them all. Sitemaps that are larger than WP_SITEMAP_MAX_BYTES once
+gzipped are split in two until they fit, which keeps them under the item
+size limit of memcached.
+"""
+
+import gzip
+import io
+import itertools
+import os
+import time
+
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import reverse
+from django.db.models import Max
+from wordpress.instrumentation import instrumented, record_cache
+from wordpress.models import Post, Taxonomy, TermTaxonomyRelationship, User, TABLE_PREFIX
+from wordpress.permalinks import DATE_STRUCTURE, PermalinkStructure
+
+SITEMAP_ROOT = getattr(settings, 'WP_SITEMAP_ROOT', None)
+SITEMAP_LIMIT = getattr(settings, 'WP_SITEMAP_LIMIT', 50000)
+SITEMAP_CACHE = getattr(settings, 'WP_SITEMAP_CACHE', None)
+SITEMAP_CACHE_TIMEOUT = getattr(settings, 'WP_SITEMAP_CACHE_TIMEOUT', None)
+SITEMAP_MAX_BYTES = getattr(settings, 'WP_SITEMAP_MAX_BYTES', 1000 * 1000)
+SITEMAP_BASE_URL = getattr(settings, 'WP_SITEMAP_BASE_URL', None)
+
+INDEX_NAME = 'sitemap'
+
+# cache entry listing the sitemaps stored by the last run
+MANIFEST_NAME = 'sitemap-manifest'
+
+# URL names of the archives of each taxonomy in wordpress.urls
+TAXONOMY_URLS = {
+    'category': 'wp_taxonomy_category',
+    'post_tag': 'wp_taxonomy_term',
+}
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def _lastmod(value):
+    return value.strftime('%Y-%m-%d') if value else None
+
+
+def iter_posts(chunk_size=5000):
+    """
+    Yield (path, lastmod) tuples for published posts.
+    """
+
+    structure = PermalinkStructure(DATE_STRUCTURE)
+    prefix = reverse('wp_archive_index')
+
+    qs = Post.objects.published().order_by('pk').values_list('id', 'slug', 'post_date', 'modified')
+    chunk_qs = qs
+
+    while True:
+
+        chunk = list(chunk_qs[:chunk_size])
+        if not chunk:
+            break
+
+        for (pk, slug, post_date, modified) in chunk:
+            yield (prefix + structure.path_for_post(pk, slug, post_date), modified)
+
+        chunk_qs = qs.filter(pk__gt=chunk[-1][0])
+
+
+def iter_terms(chunk_size=5000):
+    """
+    Yield (path, lastmod) tuples for the archives of categories and tags
+    with published posts, dated by their latest post.
+    """
+
+    qs = Taxonomy.objects.filter(name__in=TAXONOMY_URLS.keys(), count__gt=0).order_by('pk')
+    qs = qs.values_list('id', 'name', 'term__slug')
+    chunk_qs = qs
+
+    while True:
+
+        chunk = list(chunk_qs[:chunk_size])
+        if not chunk:
+            break
+
+        modified = dict(TermTaxonomyRelationship.objects
+                        .filter(term_taxonomy__in=[row[0] for row in chunk],
+                                object__post_type='post', object__status='publish')
+                        .order_by().values_list('term_taxonomy').annotate(Max('object__modified')))
+
+        for (pk, taxonomy, slug) in chunk:
+            if pk in modified:
+                yield (reverse(TAXONOMY_URLS[taxonomy], kwargs={'term': slug}), modified[pk])
+
+        chunk_qs = qs.filter(pk__gt=chunk[-1][0])
+
+
+def iter_authors(chunk_size=5000):
+    """
+    Yield (path, lastmod) tuples for the archives of authors with published
+    posts, dated by their latest post.
+    """
+
+    qs = User.objects.order_by('pk').values_list('id', 'login')
+    chunk_qs = qs
+
+    while True:
+
+        chunk = list(chunk_qs[:chunk_size])
+        if not chunk:
+            break
+
+        modified = dict(Post.objects.published().filter(author__in=[row[0] for row in chunk])
+                        .order_by().values_list('author').annotate(Max('modified')))
+
+        for (pk, login) in chunk:
+            if pk in modified:
+                yield (reverse('wp_author', args=[login]), modified[pk])
+
+        chunk_qs = qs.filter(pk__gt=chunk[-1][0])
+
+
+SECTIONS = (
+    ('posts', iter_posts),
+    ('terms', iter_terms),
+    ('authors', iter_authors),
+)
+
+
+def render_urlset(urls):
+    """
+    Return a sitemap of (location, lastmod) tuples as UTF-8 encoded XML.
+    """
+    parts = [XML_HEADER, '<urlset xmlns="%s">\n' % XMLNS]
+    for (loc, lastmod) in urls:
+        if lastmod:
+            parts.append('<url><loc>%s</loc><lastmod>%s</lastmod></url>\n' % (escape(loc), lastmod))
+        else:
+            parts.append('<url><loc>%s</loc></url>\n' % escape(loc))
+    parts.append('</urlset>\n')
+    return u''.join(parts).encode('utf-8')
+
+
+def render_index(sitemaps):
+    """
+    Return a sitemap index of (location, lastmod) tuples as UTF-8 encoded
+    XML.
+    """
+    parts = [XML_HEADER, '<sitemapindex xmlns="%s">\n' % XMLNS]
+    for (loc, lastmod) in sitemaps:
+        if lastmod:
+            parts.append('<sitemap><loc>%s</loc><lastmod>%s</lastmod></sitemap>\n' % (escape(loc), lastmod))
+        else:
+            parts.append('<sitemap><loc>%s</loc></sitemap>\n' % escape(loc))
+    parts.append('</sitemapindex>\n')
+    return u''.join(parts).encode('utf-8')
+
+
+def compress(content):
+    buf = io.BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)
+    f.write(content)
+    f.close()
+    return buf.getvalue()
+
+
+def _path(name):
+    return os.path.join(SITEMAP_ROOT, '%s.xml.gz' % name)
+
+
+def _cache_key(name):
+    return 'wordpress:%s:sitemap:%s' % (TABLE_PREFIX, name)
+
+
+def get_cache():
+    """
+    Return the cache that sitemaps are stored in when WP_SITEMAP_ROOT isn't
+    set, or None if WP_SITEMAP_CACHE isn't set either.
+    """
+    if SITEMAP_CACHE is None:
+        return None
+    try:
+        from django.core.cache import caches
+    except ImportError:
+        from django.core.cache import get_cache
+        return get_cache(SITEMAP_CACHE)
+    return caches[SITEMAP_CACHE]
+
+
+def check_storage():
+    """
+    Raise ImproperlyConfigured unless sitemaps can be stored where every
+    process serving them can read them.
+    """
+
+    if SITEMAP_ROOT:
+        return
+
+    cache = get_cache()
+    if cache is None:
+        raise ImproperlyConfigured("set WP_SITEMAP_ROOT to a directory or WP_SITEMAP_CACHE to the name "
+                                   "of a cache shared by all processes, such as memcached")
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        raise ImproperlyConfigured("the %r cache is local to each process, so WP_SITEMAP_CACHE must name "
+                                   "a shared cache, such as memcached" % SITEMAP_CACHE)
+
+
+def save(name, content):
+    """
+    Store a gzipped sitemap. Files are replaced atomically.
+    """
+    if SITEMAP_ROOT:
+        path = _path(name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(content)
+        os.rename(path + '.tmp', path)
+    else:
+        get_cache().set(_cache_key(name), (content, time.time()), SITEMAP_CACHE_TIMEOUT)
+
+
+def delete_stale(names):
+    """
+    Delete the stored sitemaps from earlier runs that aren't in names.
+    """
+
+    if SITEMAP_ROOT:
+        filenames = set('%s.xml.gz' % name for name in names)
+        for filename in os.listdir(SITEMAP_ROOT):
+            if filename.startswith('%s-' % INDEX_NAME) and filename.endswith('.xml.gz') and filename not in filenames:
+                os.remove(os.path.join(SITEMAP_ROOT, filename))
+
+    else:
+        # cache keys can't be listed, so the names stored by each run are
+        # kept to find the ones the next run no longer writes
+        cache = get_cache()
+        previous = cache.get(_cache_key(MANIFEST_NAME)) or ()
+        cache.delete_many([_cache_key(name) for name in previous if name not in names])
+        cache.set(_cache_key(MANIFEST_NAME), list(names), SITEMAP_CACHE_TIMEOUT)
+
+
+def load(name):
+    """
+    Return a tuple of a stored gzipped sitemap and the time it was stored,
+    or None if there is no sitemap with that name.
+    """
+
+    if SITEMAP_ROOT:
+        path = _path(name)
+        try:
+            with open(path, 'rb') as f:
+                return (f.read(), os.path.getmtime(path))
+        except (IOError, OSError):
+            return None
+
+    cache = get_cache()
+    if cache is None:
+        return None
+
+    stored = cache.get(_cache_key(name))
+    record_cache(stored is not None)
+    return stored
+
+
+def sitemap_name(section, page):
+    return '%s-%s-%i' % (INDEX_NAME, section, page)
+
+
+def render_shards(urls, max_bytes=SITEMAP_MAX_BYTES):
+    """
+    Return a list of (urls, gzipped sitemap) tuples for a list of
+    (location, lastmod) tuples, split in halves until each sitemap is at
+    most max_bytes long.
+    """
+    content = compress(render_urlset(urls))
+    if len(content) <= max_bytes or len(urls) == 1:
+        return [(urls, content)]
+    half = len(urls) // 2
+    return render_shards(urls[:half], max_bytes) + render_shards(urls[half:], max_bytes)
+
+
+@instrumented('sitemaps.generate')
+def generate(base_url=SITEMAP_BASE_URL, limit=SITEMAP_LIMIT, chunk_size=5000, max_bytes=SITEMAP_MAX_BYTES):
+    """
+    Generate and store every sitemap and then the sitemap index, and delete
+    the sitemaps of earlier runs that are no longer listed. Returns a list
+    of (name, URL count) tuples.
+    """
+
+    check_storage()
+
+    base_url = base_url.rstrip('/')
+    written = []
+    entries = []
+
+    for (section, func) in SECTIONS:
+
+        urls = func(chunk_size)
+        page = 0
+
+        while True:
+
+            chunk = list(itertools.islice(urls, limit))
+            if not chunk:
+                break
+
+            for (shard, content) in render_shards([(base_url + path, _lastmod(modified)) for (path, modified) in chunk],
+                                                  max_bytes):
+
+                page += 1
+                name = sitemap_name(section, page)
+                save(name, content)
+                written.append((name, len(shard)))
+
+                loc = base_url + reverse('wp_sitemap_section', kwargs={'section': section, 'page': page})
+                entries.append((loc, max(lastmod for (url, lastmod) in shard)))
+
+    save(INDEX_NAME, compress(render_index(entries)))
+    written.append((INDEX_NAME, len(entries)))
+
+    delete_stale(set(name for (name, count) in written))
+
+    return written
@@ -1,6 +1,9 @@
 from django import template
-from django.template import Context
-from wordpress.models import Post
+from django.core.cache import cache
+from django.template.base import TextNode, VariableNode
+from wordpress.instrumentation import record_cache
+from wordpress.models import Post, Taxonomy
+import hashlib
 import re
 
 register = template.Library()
@@ -13,27 +16,95 @@ class PostsContextNode(template.Node):
         self.var_name = var_name
 
     def render(self, context):
-        context[self.var_name] = self.queryset
+        context[self.var_name] = self.queryset.all()
         return ''
 
 
 class PostsTemplateNode(template.Node):
 
-    def __init__(self, queryset, nodelist):
+    def __init__(self, queryset, nodelist, timeout=None, vary=None):
         self.queryset = queryset
         self.nodelist = nodelist
+        self.timeout = timeout
+        self.vary = vary or {}
+
+    def _cache_key(self, values):
+        """
+        Key the rendered fragment on the template source, on the values of
+        the vary expressions and on the ID and modification time of each post
+        it renders.
+        """
+
+        digest = hashlib.md5(str(self.queryset.query).encode('utf-8'))
+
+        for node in self.nodelist.get_nodes_by_type(template.Node):
+            if isinstance(node, TextNode):
+                digest.update(node.s.encode('utf-8'))
+            elif isinstance(node, VariableNode):
+                digest.update(node.filter_expression.token.encode('utf-8'))
+            else:
+                digest.update(node.__class__.__name__.encode('utf-8'))
+
+        for name in sorted(values):
+            digest.update((u'%s=%s' % (name, values[name])).encode('utf-8'))
+
+        for (pk, modified) in self.queryset.values_list('pk', 'modified'):
+            digest.update(('%s:%s' % (pk, modified)).encode('utf-8'))
+
+        return 'wordpress:recentposts:%s' % digest.hexdigest()
+
+    def _isolated(self, context):
+        # cached fragments only see post and the variables the vary
+        # expressions start from, so nothing else from the page they are
+        # first rendered in ends up in the cache
+        values = dict((name.split('.')[0], context.get(name.split('.')[0])) for name in self.vary)
+        if hasattr(context, 'new'):
+            return context.new(values)
+        return template.Context(values, autoescape=context.autoescape)
+
+    def _render_posts(self, context):
+        bits = []
+        context.push()
+        try:
+            for post in self.queryset.all():
+                context['post'] = post
+                bits.append(self.nodelist.render(context))
+                bits.append('\n')
+        finally:
+            context.pop()
+        return ''.join(bits)
 
     def render(self, context):
-        content = ''
-        for post in self.queryset:
-            content += self.nodelist.render(Context({'post': post})) + '\n'
+
+        if not self.timeout:
+            return self._render_posts(context)
+
+        values = dict((name, expression.resolve(context)) for (name, expression) in self.vary.items())
+
+        key = self._cache_key(values)
+        content = cache.get(key)
+        record_cache(content is not None)
+
+        if content is None:
+            content = self._render_posts(self._isolated(context))
+            cache.set(key, content, self.timeout)
+
         return content
 
 
 def _posts(parser, token, queryset):
 
-    m = re.search(r'(?P<tag>\w+)(?: (?P<count>\d{1,4}))?(?: as (?P<var_name>\w+))?', token.contents)
+    contents = ' '.join(token.split_contents())
+    m = re.search(r'^(?P<tag>\w+)(?: (?P<count>\d{1,4}))?'
+                  r'(?: cache (?P<timeout>\d+)(?: vary (?P<vary>[\w.]+(?: (?!as\b)[\w.]+)*))?)?'
+                  r'(?: as (?P<var_name>\w+))?$', contents)
+    if not m:
+        raise template.TemplateSyntaxError("%s tag takes [count] [cache seconds [vary var ...]] or [count] as var_name"
+                                           % contents.split()[0])
+
     args = m.groupdict()
+    if args['timeout'] and args['var_name']:
+        raise template.TemplateSyntaxError("%s tag can't cache when it sets a variable with 'as'" % args['tag'])
 
     if args['count']:
         try:
@@ -47,26 +118,46 @@ def _posts(parser, token, queryset):
     else:
         nodelist = parser.parse(('end%s' % args['tag'],))
         parser.delete_first_token()
-        return PostsTemplateNode(queryset, nodelist)
+        vary = dict((name, parser.compile_filter(name)) for name in (args['vary'] or '').split())
+        return PostsTemplateNode(queryset, nodelist, int(args['timeout'] or 0), vary)
 
 
 @register.tag(name="recentposts")
 def do_recent_posts(parser, token):
-    qs = Post.objects.published()
+    """
+    {% recentposts [count] [cache seconds [vary var ...]] %}...{% endrecentposts %}
+    {% recentposts [count] as var_name %}
+
+    Cached fragments are cached separately for each value of the vary
+    variables, which may be dotted such as request.user.pk, and are
+    rendered with only post and the variables they start from, such as
+    request, in the context.
+    """
+    qs = Post.objects.published().with_terms()
     return _posts(parser, token, qs)
 
 
-# popular tags
-"""
-SELECT COUNT(1) as cnt, t.name, t.slug
-FROM sf_terms t
-JOIN sf_term_taxonomy tt ON t.term_id = tt.term_id
-JOIN sf_term_relationships tr ON tt.term_taxonomy_id = tr.term_taxonomy_id
-JOIN sf_posts p ON tr.object_id = p.id
-WHERE p.post_status = 'publish'
-    AND p.post_type = 'post'
-    AND t.slug <> 'uncategorized'
-GROUP BY t.name, t.slug
-ORDER BY cnt DESC
-LIMIT 10
-"""
+class TermsContextNode(template.Node):
+
+    def __init__(self, taxonomy, count, var_name):
+        self.taxonomy = taxonomy
+        self.count = count
+        self.var_name = var_name
+
+    def render(self, context):
+        context[self.var_name] = Taxonomy.objects.popular_terms(self.taxonomy, self.count)
+        return ''
+
+
+@register.tag(name="popularterms")
+def do_popular_terms(parser, token):
+    """
+    {% popularterms [taxonomy] [count] as var_name %}
+    """
+
+    m = re.search(r'(?P<tag>\w+)(?: (?P<taxonomy>[a-z_]+))?(?: (?P<count>\d{1,4}))? as (?P<var_name>\w+)$', token.contents)
+    if not m:
+        raise template.TemplateSyntaxError("popularterms tag requires an 'as var_name' argument")
+
+    args = m.groupdict()
+    return TermsContextNode(args['taxonomy'] or 'post_tag', int(args['count'] or 10), args['var_name'])
@@ -1,8 +1,22 @@
 from django.conf.urls import *
+from wordpress.feeds import AuthorFeed, CommentFeed, PostFeed, TaxonomyFeed
 from wordpress.views import *
 
 urlpatterns = patterns('wordpress.views',
 
+    url(r'^feed/(?:(?P<format>rss|atom)/)?$',
+        PostFeed(), name='wp_feed'),
+    url(r'^author/(?P<username>[\w-]+)/feed/(?:(?P<format>rss|atom)/)?$',
+        AuthorFeed(), name='wp_author_feed'),
+    url(r'^category/(?P<term>.+)/feed/(?:(?P<format>rss|atom)/)?$',
+        TaxonomyFeed(), {'taxonomy': 'category'}, name='wp_taxonomy_category_feed'),
+    url(r'^tag/(?P<term>.+)/feed/(?:(?P<format>rss|atom)/)?$',
+        TaxonomyFeed(), {'taxonomy': 'term'}, name='wp_taxonomy_term_feed'),
+    url(r'^taxonomy/(?P<taxonomy>term|category)/(?P<term>.+)/feed/(?:(?P<format>rss|atom)/)?$',
+        TaxonomyFeed(), name='wp_taxonomy_feed'),
+    url(r'^(?P<year>\d{4})/(?P<month>\d{1,2})/(?P<day>\d{1,2})/(?P<slug>[^/]+)/feed/(?:(?P<format>rss|atom)/)?$',
+        CommentFeed(), name='wp_object_comments_feed'),
+
     url(r'^author/(?P<username>[\w-]+)/$',
         AuthorArchive.as_view(), name='wp_author'),
 
@@ -24,9 +38,20 @@ urlpatterns = patterns('wordpress.views',
     url(r'^(?P<year>\d{4})/$',
         YearArchive.as_view(), name='wp_archive_year'),
 
+    url(r'^search/$',
+        SearchArchive.as_view(), name='wp_search'),
+
+    url(r'^sitemap\.xml$',
+        SitemapView.as_view(), name='wp_sitemap'),
+    url(r'^sitemap-(?P<section>posts|terms|authors)-(?P<page>\d+)\.xml$',
+        SitemapView.as_view(), name='wp_sitemap_section'),
+
     url(r'^post/tag/(?P<term_slug>.+)/$',
         TermArchive.as_view(), name='wp_archive_term'),
     url(r'^$',
         Archive.as_view(), name='wp_archive_index'),
 
+    url(r'^(?P<path>.+)/$',
+        PostDetail.as_view(), name='wp_object_permalink'),
+
 )
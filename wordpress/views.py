@@ -1,13 +1,37 @@
-import urllib
+import calendar
+import datetime
+import functools
+import gzip
+import hashlib
+import io
 import warnings
 
+try:
+    from django.core.exceptions import EmptyResultSet
+except ImportError:
+    from django.db.models.sql.datastructures import EmptyResultSet
+
 from django.conf import settings
-from django.http import HttpResponseRedirect, Http404
+from django.core.cache import cache
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponse, HttpResponseNotModified, HttpResponseRedirect, Http404
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
 from django.views import generic
-from wordpress.models import Post, Term, User
+from wordpress import sitemaps
+from wordpress.concurrency import run_concurrently
+from wordpress.instrumentation import record_cache
+from wordpress.models import Post, PostQuerySet, Term, User, prefetch_meta, prefetch_terms
+from wordpress.pagination import InvalidCursor, KeysetPaginator
+from wordpress.permalinks import permalinks
 
 PER_PAGE = getattr(settings, 'WP_PER_PAGE', 10)
+KEYSET_PAGINATION = getattr(settings, 'WP_KEYSET_PAGINATION', False)
+VIEW_CACHE_TIMEOUT = getattr(settings, 'WP_VIEW_CACHE_TIMEOUT', 0)
+VIEW_ETAGS = getattr(settings, 'WP_VIEW_ETAGS', False)
+VIEW_VERSION_TIMEOUT = getattr(settings, 'WP_VIEW_VERSION_TIMEOUT', 60)
+LISTING_CONTENT = getattr(settings, 'WP_LISTING_CONTENT', False)
 
 TAXONOMIES = {
     'term': 'post_tag',
@@ -16,7 +40,169 @@ TAXONOMIES = {
 }
 
 
-class AuthorArchive(generic.list.ListView):
+class KeysetPaginationMixin(object):
+    """
+    Paginates with cursor tokens instead of page numbers when keyset_paginate
+    is True. Defaults to the WP_KEYSET_PAGINATION setting.
+    """
+
+    keyset_paginate = KEYSET_PAGINATION
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.keyset_paginate:
+            return super(KeysetPaginationMixin, self).paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size)
+        cursor = self.kwargs.get(self.cursor_kwarg) or self.request.GET.get(self.cursor_kwarg)
+        try:
+            page = paginator.page(cursor)
+        except InvalidCursor:
+            raise Http404
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+
+class WithTermsMixin(object):
+    """
+    Loads the terms of the listed posts only, instead of adding with_terms()
+    to the view's queryset, so the other queries the view runs on it, such
+    as the next and previous day lookups of date archives, don't load terms.
+    """
+
+    def get_context_data(self, **kwargs):
+        object_list = kwargs.get('object_list', self.object_list)
+        if isinstance(object_list, PostQuerySet):
+            kwargs['object_list'] = object_list.with_terms()
+        return super(WithTermsMixin, self).get_context_data(**kwargs)
+
+
+def not_modified(request, etag, last_modified=None):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag in etags or '*' in etags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_modified_since and last_modified:
+        return last_modified <= if_modified_since
+    return False
+
+
+def cached_version(qs, timeout=VIEW_VERSION_TIMEOUT):
+    """
+    Return a tuple of the latest modification date of the posts in a
+    queryset and a version string of it, their count and comment total,
+    caching it by the queryset's SQL for timeout seconds.
+    """
+
+    try:
+        sql = str(qs.query).encode('utf-8')
+    except EmptyResultSet:
+        return (None, 'empty')
+
+    key = 'wordpress:version:%s:%s' % (qs.db, hashlib.md5(sql).hexdigest())
+    version = cache.get(key)
+    record_cache(version is not None)
+
+    if version is None:
+        stats = qs.order_by().aggregate(modified=Max('modified_gmt'), count=Count('pk'), comments=Sum('comment_count'))
+        version = (stats['modified'], '%(modified)s:%(count)s:%(comments)s' % stats)
+        cache.set(key, version, timeout)
+
+    return version
+
+
+def date_range(year, month=None, day=None):
+    """
+    Return the start and end datetimes of a year, month or day.
+    """
+    try:
+        start = datetime.datetime(int(year), int(month or 1), int(day or 1))
+        if day:
+            end = start + datetime.timedelta(days=1)
+        elif month:
+            end = (start + datetime.timedelta(days=32)).replace(day=1)
+        else:
+            end = start.replace(year=start.year + 1)
+    except (OverflowError, ValueError):
+        raise Http404("Invalid date")
+    return (start, end)
+
+
+class CacheMixin(object):
+    """
+    Adds ETag and Last-Modified headers and answers conditional GETs with
+    304 responses if use_etags is set, defaulting to the WP_VIEW_ETAGS
+    setting. If cache_timeout is set, defaulting to the
+    WP_VIEW_CACHE_TIMEOUT setting, rendered responses are cached as well.
+    With neither set, no version is computed.
+
+    Responses are keyed on the URL and the version stamp returned by
+    get_cache_version(). For lists of posts it is read from the posts in
+    get_version_queryset() and cached for WP_VIEW_VERSION_TIMEOUT seconds,
+    so a new version replaces cached responses at most that long after the
+    posts it covers change.
+    """
+
+    cache_timeout = VIEW_CACHE_TIMEOUT
+    use_etags = VIEW_ETAGS
+
+    def get_version_queryset(self):
+        """
+        Return the posts shown by the view, narrowed to the current page's
+        filters, or None to skip versioning.
+        """
+        return self.get_queryset()
+
+    def get_cache_version(self):
+        """
+        Return a tuple of the last modified datetime in UTC and a version
+        string, or None to skip caching.
+        """
+        qs = self.get_version_queryset()
+        if qs is None:
+            return None
+        return cached_version(qs)
+
+    def get(self, request, *args, **kwargs):
+
+        if not (self.use_etags or self.cache_timeout):
+            return super(CacheMixin, self).get(request, *args, **kwargs)
+
+        version = self.get_cache_version()
+        if version is None:
+            return super(CacheMixin, self).get(request, *args, **kwargs)
+
+        (modified, stamp) = version
+        last_modified = calendar.timegm(modified.utctimetuple()) if modified else None
+        etag = hashlib.md5((u'%s|%s' % (request.build_absolute_uri(), stamp)).encode('utf-8')).hexdigest()
+
+        if self.use_etags and not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+
+        else:
+
+            key = 'wordpress:view:%s' % etag
+            response = cache.get(key) if self.cache_timeout else None
+            if self.cache_timeout:
+                record_cache(response is not None)
+
+            if response is None:
+                response = super(CacheMixin, self).get(request, *args, **kwargs)
+                if self.cache_timeout and response.status_code == 200:
+                    timeout = self.cache_timeout
+                    if hasattr(response, 'add_post_render_callback'):
+                        response.add_post_render_callback(lambda r: cache.set(key, r, timeout))
+                    else:
+                        cache.set(key, response, timeout)
+
+        if self.use_etags:
+            response['ETag'] = quote_etag(etag)
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+
+        return response
+
+
+class AuthorArchive(WithTermsMixin, KeysetPaginationMixin, CacheMixin, generic.list.ListView):
 
     allow_empty = True
     context_object_name = "post_list"
@@ -31,7 +217,7 @@ class AuthorArchive(generic.list.ListView):
         return super(AuthorArchive, self).get(request, *args, **kwargs)
 
     def get_queryset(self):
-        return Post.objects.published().filter(author=self.author)
+        return Post.objects.published().listing(LISTING_CONTENT).filter(author=self.author)
 
     def get_context_data(self, **kwargs):
         context = super(AuthorArchive, self).get_context_data(**kwargs)
@@ -51,7 +237,7 @@ class Preview(generic.detail.DetailView):
         return context
 
 
-class PostDetail(generic.dates.DateDetailView):
+class PostDetail(CacheMixin, generic.dates.DateDetailView):
 
     allow_future = True
     context_object_name = 'post'
@@ -59,14 +245,41 @@ class PostDetail(generic.dates.DateDetailView):
     month_format = "%m"
     queryset = Post.objects.published()
 
+    # batch loaders run, concurrently if WP_CONCURRENT_LOOKUPS is set, before
+    # the post is rendered
+    loaders = (prefetch_terms,)
+
+    # meta keys that the template reads, loaded with the batch loaders; any
+    # other meta is loaded when it is first read
+    meta_keys = ()
+
+    def get_loaders(self):
+        loaders = [functools.partial(loader, [self.object]) for loader in self.loaders]
+        if self.meta_keys:
+            loaders.append(functools.partial(prefetch_meta, [self.object], keys=set(self.meta_keys)))
+        return loaders
+
     def get_context_data(self, **kwargs):
         context = super(PostDetail, self).get_context_data(**kwargs)
         context.update({'post_url': self.request.build_absolute_uri(self.request.path)})
+        run_concurrently(*self.get_loaders())
         return context
 
+    def get_cache_version(self):
+        post = self.get_object()
+        return (post.modified_gmt, '%s:%s' % (post.modified_gmt, post.comment_count))
+
+    def get_path(self):
+        if 'path' in self.kwargs:
+            return self.kwargs['path']
+        return '/'.join(self.kwargs[name] for name in ('year', 'month', 'day', 'slug'))
+
     def get_object(self):
-        self.kwargs['slug'] = urllib.quote(self.kwargs['slug'].encode('utf-8')).lower()
-        return super(PostDetail, self).get_object()
+        if getattr(self, '_object', None) is None:
+            self._object = permalinks.get_post(self.get_path(), self.get_queryset())
+            if self._object is None:
+                raise Http404("No post found at %s" % self.get_path())
+        return self._object
 
     def get(self, request, *args, **kwargs):
         return super(PostDetail, self).get(request, *args, **kwargs)
@@ -75,33 +288,47 @@ class PostDetail(generic.dates.DateDetailView):
 class PostAttachment(PostDetail):
 
     def get(self, request, *args, **kwargs):
-        post = self.get_object()
-        attachment = get_object_or_404(Post, post_type='attachment', slug=self.kwargs['attachment_slug'], parent_id=post.pk)
-        return HttpResponseRedirect(attachment.guid)
+        post_id = permalinks.resolve(self.get_path()) or self.get_object().pk
+        url = permalinks.get_attachment_url(post_id, self.kwargs['attachment_slug'])
+        if url is None:
+            raise Http404("No attachment found matching the query")
+        return HttpResponseRedirect(url)
 
 
-class DayArchive(generic.dates.DayArchiveView):
+class DayArchive(WithTermsMixin, KeysetPaginationMixin, CacheMixin, generic.dates.DayArchiveView):
     context_object_name = 'post_list'
     date_field = 'post_date'
     month_format = '%m'
     paginate_by = PER_PAGE
-    queryset = Post.objects.published()
+    queryset = Post.objects.published().listing(LISTING_CONTENT)
+
+    def get_version_queryset(self):
+        (start, end) = date_range(self.get_year(), self.get_month(), self.get_day())
+        return self.get_queryset().filter(post_date__gte=start, post_date__lt=end)
 
 
-class MonthArchive(generic.dates.MonthArchiveView):
+class MonthArchive(WithTermsMixin, KeysetPaginationMixin, CacheMixin, generic.dates.MonthArchiveView):
     context_object_name = 'post_list'
     date_field = 'post_date'
     month_format = '%m'
     paginate_by = PER_PAGE
-    queryset = Post.objects.published()
+    queryset = Post.objects.published().listing(LISTING_CONTENT)
+
+    def get_version_queryset(self):
+        (start, end) = date_range(self.get_year(), self.get_month())
+        return self.get_queryset().filter(post_date__gte=start, post_date__lt=end)
 
 
-class YearArchive(generic.dates.YearArchiveView):
+class YearArchive(WithTermsMixin, CacheMixin, generic.dates.YearArchiveView):
     date_field = 'post_date'
-    queryset = Post.objects.published()
+    queryset = Post.objects.published().listing(LISTING_CONTENT)
 
+    def get_version_queryset(self):
+        (start, end) = date_range(self.get_year())
+        return self.get_queryset().filter(post_date__gte=start, post_date__lt=end)
 
-class Archive(generic.dates.ArchiveIndexView):
+
+class Archive(WithTermsMixin, KeysetPaginationMixin, CacheMixin, generic.dates.ArchiveIndexView):
 
     allow_empty = True
     context_object_name = 'post_list'
@@ -116,10 +343,69 @@ class Archive(generic.dates.ArchiveIndexView):
         return super(Archive, self).get(request, *args, **kwargs)
 
     def get_queryset(self):
-        return Post.objects.published().select_related()
+        return Post.objects.published().listing(LISTING_CONTENT).select_related()
+
+
+class SearchArchive(generic.list.ListView):
+    """
+    Published posts matching the words in the q query parameter. See
+    PostManager.search().
+    """
+
+    allow_empty = True
+    context_object_name = 'post_list'
+    paginate_by = PER_PAGE
+    template_name = 'wordpress/post_search.html'
+
+    def get_queryset(self):
+        self.query = self.request.GET.get('q', '').strip()
+        if not self.query:
+            return Post.objects.none()
+        return Post.objects.search(self.query, Post.objects.published().with_terms().listing(LISTING_CONTENT))
+
+    def get_context_data(self, **kwargs):
+        context = super(SearchArchive, self).get_context_data(**kwargs)
+        context['query'] = self.query
+        return context
+
+
+class SitemapView(generic.View):
+    """
+    Serves the sitemap index, or the sitemap of a section and page, stored
+    by the wpsitemaps command. See wordpress.sitemaps.
+    """
+
+    def get(self, request, section=None, page=None):
+
+        if section is None:
+            name = sitemaps.INDEX_NAME
+        else:
+            name = sitemaps.sitemap_name(section, int(page))
+
+        stored = sitemaps.load(name)
+        if stored is None:
+            raise Http404("No sitemap named %s" % name)
+
+        (content, stored_at) = stored
+        last_modified = int(stored_at)
+        etag = hashlib.md5((u'%s|%s' % (name, stored_at)).encode('utf-8')).hexdigest()
+
+        if not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+        elif 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response = HttpResponse(content, content_type='application/xml; charset=utf-8')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            content = gzip.GzipFile(fileobj=io.BytesIO(content)).read()
+            response = HttpResponse(content, content_type='application/xml; charset=utf-8')
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        response['ETag'] = quote_etag(etag)
+        response['Last-Modified'] = http_date(last_modified)
+        return response
 
 
-class TaxonomyArchive(generic.list.ListView):
+class TaxonomyArchive(WithTermsMixin, KeysetPaginationMixin, CacheMixin, generic.list.ListView):
 
     allow_empty = True
     context_object_name = "post_list"
@@ -137,7 +423,7 @@ class TaxonomyArchive(generic.list.ListView):
     def get_queryset(self):
         taxonomy = TAXONOMIES.get(self.kwargs['taxonomy'], None)
         if taxonomy:
-            return Post.objects.term(self.kwargs['term'], taxonomy=taxonomy).select_related()
+            return Post.objects.term(self.kwargs['term'], taxonomy=taxonomy).listing(LISTING_CONTENT).select_related()
 
 
 class TermArchive(generic.list.ListView):
@@ -0,0 +1,191 @@
+"""
+Streaming writer for WordPress eXtended RSS (WXR) export files.
+"""
+
+import datetime
+
+try:
+    from urllib.parse import urljoin
+except ImportError:
+    from urlparse import urljoin
+
+from django.conf import settings
+from django.core.urlresolvers import NoReverseMatch
+from wordpress import serialize
+from wordpress.models import Option, User
+from xml.sax.saxutils import escape, quoteattr
+
+WXR_VERSION = '1.2'
+
+RSS_OPEN = u"""<?xml version="1.0" encoding="UTF-8" ?>
+<!-- This is a WordPress eXtended RSS file generated by django-wordpress as an export of your site. -->
+<!-- To import it into a WordPress site, use the WordPress importer in Tools: Import. -->
+<rss version="2.0"
+    xmlns:excerpt="http://wordpress.org/export/%(version)s/excerpt/"
+    xmlns:content="http://purl.org/rss/1.0/modules/content/"
+    xmlns:wfw="http://wellformedweb.org/CommentAPI/"
+    xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:wp="http://wordpress.org/export/%(version)s/"
+>
+
+<channel>
+"""
+
+RSS_CLOSE = u"""
+</channel>
+</rss>
+"""
+
+
+def cdata(value):
+    return u'<![CDATA[%s]]>' % (value or u'').replace(u']]>', u']]]]><![CDATA[>')
+
+
+def rfc822(dt):
+    return dt.strftime('%a, %d %b %Y %H:%M:%S +0000') if dt else u''
+
+
+def wpdate(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S') if dt else u''
+
+
+class WXRWriter(object):
+    """
+    Writes posts to a stream as WXR, one post at a time.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.home = Option.objects.get_value('home') or ''
+        self._sticky = None
+
+    def write(self, value):
+        self.stream.write(value)
+
+    def _element(self, name, value, indent=8):
+        self.write(u'%s<%s>%s</%s>\n' % (u' ' * indent, name, value, name))
+
+    # channel
+
+    def write_header(self, generator=None):
+
+        options = Option.objects
+        self.write(RSS_OPEN % {'version': WXR_VERSION})
+
+        self._element('title', escape(options.get_value('blogname') or u''), 4)
+        self._element('link', escape(self.home), 4)
+        self._element('description', escape(options.get_value('blogdescription') or u''), 4)
+        self._element('pubDate', rfc822(datetime.datetime.utcnow()), 4)
+        self._element('language', escape(getattr(settings, 'LANGUAGE_CODE', 'en-us')), 4)
+        self._element('wp:wxr_version', WXR_VERSION, 4)
+        self._element('wp:base_site_url', escape(options.get_value('siteurl') or u''), 4)
+        self._element('wp:base_blog_url', escape(self.home), 4)
+
+        if generator:
+            self._element('generator', escape(generator), 4)
+
+        self.write(u'\n')
+
+    def write_footer(self):
+        self.write(RSS_CLOSE)
+
+    def write_author(self, author_id, login, email, display_name):
+        self.write(u'    <wp:author>')
+        self.write(u'<wp:author_id>%s</wp:author_id>' % author_id)
+        self.write(u'<wp:author_login>%s</wp:author_login>' % escape(login))
+        self.write(u'<wp:author_email>%s</wp:author_email>' % escape(email))
+        self.write(u'<wp:author_display_name>%s</wp:author_display_name>' % cdata(display_name))
+        self.write(u'</wp:author>\n')
+
+    def write_authors(self, author_ids, chunk_size=500):
+        """
+        Write the authors with the given IDs, loading them in chunks.
+        """
+        author_ids = sorted(author_ids)
+        for i in range(0, len(author_ids), chunk_size):
+            qs = User.objects.filter(pk__in=author_ids[i:i + chunk_size]).order_by('pk')
+            for row in qs.values_list('id', 'login', 'email', 'display_name'):
+                self.write_author(*row)
+        self.write(u'\n')
+
+    # items
+
+    def is_sticky(self, post):
+        if self._sticky is None:
+            sticky = serialize.maybe_loads(Option.objects.get_value('sticky_posts'))
+            self._sticky = set(sticky.values()) if isinstance(sticky, dict) else set()
+        return post.pk in self._sticky
+
+    def link(self, post):
+        try:
+            return urljoin(self.home, post.get_absolute_url())
+        except NoReverseMatch:
+            return post.guid
+
+    def write_post(self, post, comments=()):
+
+        write = self.write
+        element = self._element
+
+        write(u'    <item>\n')
+
+        element('title', escape(post.title))
+        element('link', escape(self.link(post)))
+        element('pubDate', rfc822(post.post_date_gmt))
+        element('dc:creator', cdata(post.author.login))
+        write(u'        <guid isPermaLink="false">%s</guid>\n' % escape(post.guid))
+        element('description', u'')
+        element('content:encoded', cdata(post.content))
+        element('excerpt:encoded', cdata(post.excerpt))
+        element('wp:post_id', post.pk)
+        element('wp:post_date', wpdate(post.post_date))
+        element('wp:post_date_gmt', wpdate(post.post_date_gmt))
+        element('wp:comment_status', escape(post.comment_status))
+        element('wp:ping_status', escape(post.ping_status))
+        element('wp:post_name', escape(post.slug))
+        element('wp:status', escape(post.status))
+        element('wp:post_parent', post.parent_id)
+        element('wp:menu_order', post.menu_order)
+        element('wp:post_type', escape(post.post_type))
+        element('wp:post_password', escape(post.password))
+        element('wp:is_sticky', 1 if self.is_sticky(post) else 0)
+
+        if post.post_type == 'attachment':
+            element('wp:attachment_url', escape(post.guid))
+
+        for (taxonomy, terms) in sorted((post.term_cache or {}).items()):
+            for term in terms:
+                write(u'        <category domain=%s nicename=%s>%s</category>\n' % (
+                    quoteattr(taxonomy), quoteattr(term.slug), cdata(term.name)))
+
+        meta = post.meta_dict
+        for key in sorted(meta):
+            for value in meta.getlist(key):
+                write(u'        <wp:postmeta>\n')
+                element('wp:meta_key', escape(key), 12)
+                element('wp:meta_value', cdata(value), 12)
+                write(u'        </wp:postmeta>\n')
+
+        for comment in comments:
+            self.write_comment(comment)
+
+        write(u'    </item>\n')
+
+    def write_comment(self, comment):
+
+        element = self._element
+
+        self.write(u'        <wp:comment>\n')
+        element('wp:comment_id', comment.pk, 12)
+        element('wp:comment_author', cdata(comment.author_name), 12)
+        element('wp:comment_author_email', escape(comment.author_email), 12)
+        element('wp:comment_author_url', escape(comment.author_url), 12)
+        element('wp:comment_author_IP', escape(comment.author_ip or u''), 12)
+        element('wp:comment_date', wpdate(comment.post_date_local), 12)
+        element('wp:comment_date_gmt', wpdate(comment.post_date), 12)
+        element('wp:comment_content', cdata(comment.content), 12)
+        element('wp:comment_approved', escape(comment.approved), 12)
+        element('wp:comment_type', escape(comment.comment_type), 12)
+        element('wp:comment_parent', comment.parent_id, 12)
+        element('wp:comment_user_id', comment.user_id, 12)
+        self.write(u'        </wp:comment>\n')